@@ -0,0 +1,116 @@
+"""
+Streaming verification of signed tar archive members.
+
+Archive (plain, gzip, bz2 or xz compressed tar) is read once, sequentially and without extraction:
+member [name] is hashed while it streams by and matched with member [name].sign, which may come before
+or after it. Content of members is never kept, only digests of members whose signature was not seen yet
+and DER of signatures whose member was not seen yet, so memory depends on the number of unmatched members,
+not on their sizes. Works on non-seekable streams (pipes, sockets, stdin).
+"""
+import tarfile
+
+from pyasn1.error import PyAsn1Error
+
+from core import STAGE_DECODE, RejectedError, VerificationError, VerifyResult, check_cosigners, \
+    check_filesize, check_signature, default_hasher, verify_signers
+from pipeline import DEFAULT_CHUNK_SIZE, hash_chunks
+from structs import decode_signature
+
+SIGN_SUFFIX = '.sign'
+# Signatures are about 1 KB, bigger .sign members are rejected unread
+MAX_SIGN_SIZE = 1 << 16
+
+
+def _chunks(f, chunk_size):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _check(der, filesize, own_pubkey):
+    """
+    Decode signature and run checks done before hashing, returns (struct, checked, checked co-signers)
+    """
+    if der is None:
+        raise RejectedError(STAGE_DECODE, 'Signature member is larger than {0} bytes'.format(MAX_SIGN_SIZE))
+    try:
+        struct = decode_signature(der)
+    except PyAsn1Error as e:
+        raise RejectedError(STAGE_DECODE, e)
+    checked = check_signature(struct, own_pubkey)
+    cosigners = check_cosigners(struct)
+    check_filesize(struct, filesize=filesize)
+    return struct, checked, cosigners
+
+
+def _verify(name, der, dgst, filesize, own_pubkey, cache, quorum, signer_keys, checked=None):
+    try:
+        if checked is None:
+            checked = _check(der, filesize, own_pubkey)
+        struct, checked, cosigners = checked
+        is_verified, signers = verify_signers(checked, cosigners, dgst, cache=cache, quorum=quorum, signer_keys=signer_keys)
+        return VerifyResult(name, is_verified, struct, dgst, signers=signers if cosigners else None)
+    except VerificationError as e:
+        return e
+    except Exception as e:
+        return VerificationError(e)
+
+
+def verify_archive(archive, own_pubkey=None, cache=None, chunk_size=DEFAULT_CHUNK_SIZE, quorum=None,
+                   signer_keys=None):
+    """
+    Verify signed members of tar archive in one pass
+    :param archive: archive path or readable binary file object
+    :param quorum: for co-signature containers, number of valid signatures required, all by default
+    :param signer_keys: for co-signature containers, open keys whose signatures count towards quorum
+    :return: generator of (member name, result) in the order pairs complete, result is VerifyResult or
+        VerificationError (RejectedError for rejections). Members without .sign and signatures without member
+        get failed VerifyResult after the whole archive is read
+    :raises tarfile.TarError: if archive is damaged
+    """
+    if isinstance(archive, str):
+        tar = tarfile.open(archive, mode='r|*')
+    else:
+        tar = tarfile.open(fileobj=archive, mode='r|*')
+    # Member name -> (digest, size), waiting for .sign
+    digests = {}
+    # Member name -> DER (None if too large), waiting for member
+    signatures = {}
+    with tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = member.name
+            if name.endswith(SIGN_SUFFIX):
+                target = name[:-len(SIGN_SUFFIX)]
+                der = tar.extractfile(member).read() if member.size <= MAX_SIGN_SIZE else None
+                if target in digests:
+                    dgst, filesize = digests.pop(target)
+                    yield target, _verify(target, der, dgst, filesize, own_pubkey, cache, quorum, signer_keys)
+                else:
+                    signatures[target] = der
+                continue
+
+            checked = None
+            if name in signatures:
+                # Signature came first, rejected members are skipped without hashing
+                try:
+                    checked = _check(signatures.pop(name), member.size, own_pubkey)
+                except VerificationError as e:
+                    yield name, e
+                    continue
+                except Exception as e:
+                    yield name, VerificationError(e)
+                    continue
+            dgst = hash_chunks(_chunks(tar.extractfile(member), chunk_size), default_hasher())
+            if checked is None:
+                digests[name] = dgst, member.size
+            else:
+                yield name, _verify(name, None, dgst, member.size, own_pubkey, cache, quorum, signer_keys, checked)
+
+    for name in digests:
+        yield name, VerifyResult(name, False, message='Cant find {0}{1} in archive'.format(name, SIGN_SUFFIX))
+    for name in signatures:
+        yield name, VerifyResult(name, False, message='Signed member {0} is not in archive'.format(name))
@@ -0,0 +1,117 @@
+"""
+Batch signing and verification by thread pool.
+
+Signer / Verifier contexts are immutable after construction and are shared by all threads, base point
+tables are built once per curve (GOST3410Curve.base_table), VerificationCache, SignatureBundle and
+attached shared tables lock internally, so gost and core can be used from many threads.
+With the GIL only file reading overlaps with hashing; on free-threaded CPython 3.13+ (python3.13t)
+Streebog and EC arithmetic of different files run on different cores.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from core import Signer, SigningError, VerificationError, verify_file
+
+
+def _map(fn, items, threads):
+    with ThreadPoolExecutor(threads or os.cpu_count() or 1) as pool:
+        for result in pool.map(fn, items):
+            yield result
+
+
+def sign_batch(paths, curve=None, prv=None, threads=None, bundle=None, signer=None):
+    """
+    Sign files by thread pool, signatures go to [path].sign files or bundle
+    :param signer: Signer to use instead of creating one for curve and prv
+    :return: generator of (path, SignResult or SigningError) in order of paths
+    """
+    signer = signer or Signer(curve, prv)
+
+    def sign(path):
+        try:
+            return path, signer.sign_file(path, bundle=bundle)
+        except SigningError as e:
+            return path, e
+
+    return _map(sign, list(paths), threads)
+
+
+def verify_batch(files, own_pubkey=None, bundle=None, cache=None, threads=None, verifier=None):
+    """
+    Verify files by thread pool
+    :param files: file paths or (file path, sign path) pairs
+    :param verifier: Verifier for files signed by one key, signatures by other keys are rejected
+    :return: generator of (path, VerifyResult or VerificationError) in order of files
+    """
+    items = [(f, None) if isinstance(f, str) else tuple(f) for f in files]
+
+    def verify(item):
+        path, sign_path = item
+        try:
+            if verifier is not None:
+                return path, verifier.verify_file(path, sign_path=sign_path, bundle=bundle)
+            return path, verify_file(path, sign_path=sign_path, own_pubkey=own_pubkey, bundle=bundle, cache=cache)
+        except VerificationError as e:
+            return path, e
+
+    return _map(verify, items, threads)
+
+
+def _verify_path(path):
+    return bool(verify_file(path))
+
+
+if __name__ == '__main__':
+    # Thread pool scaling against process pool: python batch.py [files] [file size] [max workers]
+    import shutil
+    import sys
+    import tempfile
+    import threading
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    from gost import gost341012
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 2048
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else max(os.cpu_count() or 1, 4)
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('Python {0}, GIL {1}, {2} CPUs'.format(sys.version.split()[0], 'enabled' if gil else 'disabled', os.cpu_count()))
+
+    curve = gost341012.GOST3410Curve(*gost341012.CURVE_PARAMS['GostR3410_2012_TC26_ParamSetA'])
+    # Concurrent first use builds base table once
+    tables = []
+    starters = [threading.Thread(target=lambda: tables.append(curve.base_table())) for _ in range(4)]
+    for thread in starters:
+        thread.start()
+    for thread in starters:
+        thread.join()
+    assert all(table is tables[0] for table in tables)
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(count):
+            path = os.path.join(directory, 'file{0}'.format(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+            paths.append(path)
+        signer = Signer(curve, gost341012.prv_unmarshal(os.urandom(64)))
+        assert all(not isinstance(r, Exception) for _, r in sign_batch(paths, signer=signer))
+
+        workers = 1
+        while workers <= max_workers:
+            started = time.perf_counter()
+            results = list(verify_batch(paths, threads=workers))
+            threaded = time.perf_counter() - started
+            assert all(r.ok for _, r in results)
+            started = time.perf_counter()
+            with ProcessPoolExecutor(workers) as pool:
+                assert all(pool.map(_verify_path, paths))
+            processes = time.perf_counter() - started
+            print('{0} workers: threads {1:.1f} files/s, processes {2:.1f} files/s'.format(
+                workers, count / threaded, count / processes
+            ))
+            workers *= 2
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,450 @@
+"""
+Signature bundle: many signatures in one file.
+
+Layout (all integers are big-endian):
+
+    header   MAGIC
+    records  [u16 name length][name, utf-8][u32 der length][DER, see structs.encode_signature] ...
+    index    [16 bytes md5(name)][u64 record offset][u32 record length] ... sorted by key
+    trailer  [u64 index offset][u64 entries count][u64 end of previous trailer or 0]
+             [u64 live entries][u64 live records bytes][INDEX_MAGIC]
+
+Every flush appends new records followed by an index of these records only (a level) and
+a trailer chained to the previous level, so appending never rewrites existing records and
+readers that already mapped the file keep seeing a consistent (older) state.
+Levels are merged like a binary counter: new level absorbs older levels up to twice its size,
+so there are O(log n) levels and every entry is rewritten O(log n) times. Lookups search
+levels from the newest one. Only the last valid trailer in the file is used: records are synced
+before the trailer is written, bytes after the last valid trailer (left by an interrupted flush)
+are ignored by readers and truncated by the next flush.
+When replaced records and merged indexes take more than half of the file, it is compacted
+into a new file. Writers serialize on flock() of the bundle file and re-read its trailer
+before appending, so bundle objects of different threads and processes don't lose entries.
+"""
+import mmap
+import os
+import posixpath
+import struct
+import threading
+from functools import wraps
+from hashlib import md5
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from structs import decode_signature, encode_signature
+
+MAGIC = b'GSTBNDL1'
+INDEX_MAGIC = b'GSTBIDX2'
+# Single merged index of bundles written before index levels
+INDEX_MAGIC_V1 = b'GSTBIDX1'
+# Files smaller than this are never compacted
+COMPACT_MIN_SIZE = 1 << 16
+
+_NAME_LEN = struct.Struct('>H')
+_DER_LEN = struct.Struct('>I')
+_INDEX_ENTRY = struct.Struct('>16sQI')
+_TRAILER = struct.Struct('>QQQQQ8s')
+_TRAILER_V1 = struct.Struct('>QQ8s')
+
+
+class BundleError(ValueError):
+    """Raised when bundle file is malformed."""
+
+
+def _locked(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _flock(f, operation):
+    """
+    flock() by fcntl operation name, does nothing where fcntl is not available
+    """
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), getattr(fcntl, operation))
+
+
+def _write(f, data):
+    """
+    Write all of data to unbuffered file
+    """
+    view = memoryview(data)
+    while view:
+        view = view[f.write(view):]
+
+
+def bundle_key(name):
+    return md5(name.encode('utf-8')).digest()
+
+
+def entry_name(name):
+    """
+    Normalized entry name: posix separators, no "." / ".." components, so ./a.txt and a.txt are one entry
+    """
+    return posixpath.normpath(name.replace(os.sep, '/'))
+
+
+class SignatureBundle(object):
+    """
+    Indexed container of signatures, addressed by file path relative to the bundle directory.
+    Lookups memory-map the file and binary search the index, reading only the matching record.
+    Added signatures are buffered and written on flush() / close().
+    Bundle object can be shared by threads, lookups and appends are serialized.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self._file = None
+        self._map = None
+        # (index offset, entries count, trailer end) of index levels, newest first
+        self._levels = []
+        self._count = 0
+        self._live_bytes = 0
+        # End of the last valid trailer, appends start here
+        self._end = 0
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @_locked
+    def __len__(self):
+        return self._count + sum(1 for name in self._pending if self._find(name) is None)
+
+    @_locked
+    def __contains__(self, name):
+        name = entry_name(name)
+        return name in self._pending or self._find(name) is not None
+
+    def name_for(self, path):
+        """
+        Bundle entry name for file path
+        """
+        return entry_name(os.path.relpath(os.path.abspath(path), self.root))
+
+    def _open(self):
+        self._close_map()
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        try:
+            # Don't map the file while a writer appends to it
+            _flock(f, 'LOCK_SH')
+            self._load(f)
+            if self._file is f:
+                _flock(f, 'LOCK_UN')
+        finally:
+            if self._file is not f:
+                f.close()
+
+    def _load(self, f):
+        """
+        Map opened bundle file and read its index levels, empty file is closed
+        """
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC):
+            head = f.read()
+            f.close()
+            # Empty file or header of the first flush torn by crash
+            if not MAGIC.startswith(head):
+                raise BundleError('{0} is not a signature bundle'.format(self.path))
+            return
+        self._file = f
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._close_map()
+            raise BundleError('{0} is not a signature bundle'.format(self.path))
+        # Bytes after the last valid trailer are left by an interrupted flush, skip them
+        for end in self._trailer_ends():
+            try:
+                self._load_levels(end)
+                self._end = end
+                return
+            except (BundleError, struct.error):
+                continue
+        self._levels = []
+        self._count = 0
+        self._live_bytes = 0
+        self._end = len(MAGIC)
+
+    def _trailer_ends(self):
+        """
+        Candidate trailer ends: end of file, then ends of index magics towards the start of file
+        """
+        yield len(self._map)
+        pos = len(self._map)
+        while True:
+            pos = max(self._map.rfind(INDEX_MAGIC, 0, pos - 1), self._map.rfind(INDEX_MAGIC_V1, 0, pos - 1))
+            if pos < len(MAGIC):
+                return
+            if pos + len(INDEX_MAGIC) < len(self._map):
+                yield pos + len(INDEX_MAGIC)
+
+    def _load_levels(self, end):
+        self._levels = []
+        if end < len(MAGIC) + _TRAILER_V1.size:
+            raise BundleError()
+        if self._map[end - len(INDEX_MAGIC_V1):end] == INDEX_MAGIC_V1:
+            index_offset, count, _ = _TRAILER_V1.unpack_from(self._map, end - _TRAILER_V1.size)
+            if index_offset + count * _INDEX_ENTRY.size + _TRAILER_V1.size != end:
+                raise BundleError()
+            # Old trailer can't be chained to, the level is merged on next flush
+            self._levels = [(index_offset, count, None)]
+            self._count = count
+            self._live_bytes = sum(self._entry(0, idx)[2] for idx in range(count))
+            return
+
+        first = True
+        while end:
+            if end < len(MAGIC) + _TRAILER.size:
+                raise BundleError()
+            index_offset, count, previous, live, live_bytes, magic = _TRAILER.unpack_from(
+                self._map, end - _TRAILER.size)
+            if magic != INDEX_MAGIC or index_offset + count * _INDEX_ENTRY.size + _TRAILER.size != end \
+                    or previous >= end:
+                raise BundleError()
+            if first:
+                self._count = live
+                self._live_bytes = live_bytes
+                first = False
+            self._levels.append((index_offset, count, end))
+            end = previous
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._map = None
+        self._file = None
+        self._levels = []
+        self._count = 0
+        self._live_bytes = 0
+        self._end = 0
+
+    def _entry(self, level, idx):
+        return _INDEX_ENTRY.unpack_from(self._map, self._levels[level][0] + idx * _INDEX_ENTRY.size)
+
+    def _record(self, offset):
+        name_len, = _NAME_LEN.unpack_from(self._map, offset)
+        offset += _NAME_LEN.size
+        name = self._map[offset:offset + name_len].decode('utf-8')
+        offset += name_len
+        der_len, = _DER_LEN.unpack_from(self._map, offset)
+        offset += _DER_LEN.size
+        return name, self._map[offset:offset + der_len]
+
+    def _find_entry(self, name):
+        """
+        Binary search index levels for name, returns (record offset, record length) or None
+        """
+        key = bundle_key(name)
+        for level, (_, count, _) in enumerate(self._levels):
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._entry(level, mid)[0] < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            # Different names may share key, check every record in the run
+            while lo < count:
+                entry_key, offset, length = self._entry(level, lo)
+                if entry_key != key:
+                    break
+                if self._record(offset)[0] == name:
+                    return offset, length
+                lo += 1
+        return None
+
+    def _find(self, name):
+        """
+        Record offset for name or None
+        """
+        entry = self._find_entry(name)
+        return entry[0] if entry is not None else None
+
+    def _live_entries(self):
+        """
+        (key, offset, length) of live records, replaced ones are skipped
+        """
+        seen = set()
+        for level, (_, count, _) in enumerate(self._levels):
+            for idx in range(count):
+                key, offset, length = self._entry(level, idx)
+                name = self._record(offset)[0]
+                if name not in seen:
+                    seen.add(name)
+                    yield key, offset, length
+
+    @_locked
+    def get_raw(self, name):
+        """
+        DER-encoded signature stored for name or None
+        """
+        name = entry_name(name)
+        if name in self._pending:
+            return self._pending[name]
+        offset = self._find(name)
+        if offset is None:
+            return None
+        return self._record(offset)[1]
+
+    def get(self, name):
+        """
+        Decoded SignatureSequence (CoSignedSequence for co-signature container) stored for name or None
+        """
+        raw = self.get_raw(name)
+        if raw is None:
+            return None
+        return decode_signature(raw)
+
+    @_locked
+    def names(self):
+        names = [self._record(offset)[0] for _, offset, _ in self._live_entries()]
+        names.extend(name for name in self._pending if self._find(name) is None)
+        return names
+
+    @_locked
+    def add(self, name, signature):
+        """
+        Buffer signature for name, replaces previous entry with the same name after flush()
+        :param name: entry name (see name_for())
+        :param signature: SignatureSequence, CoSignedSequence or DER encoding
+        """
+        if not isinstance(signature, bytes):
+            signature = encode_signature(signature)
+        self._pending[entry_name(name)] = signature
+
+    def _lock_file(self):
+        """
+        Open bundle file for appending and lock it exclusively, waits if another writer has it.
+        The file may be replaced by compaction while waiting, then the new one is locked
+        """
+        while True:
+            # Unbuffered, so an interrupted flush can be truncated away
+            f = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b', buffering=0)
+            _flock(f, 'LOCK_EX')
+            try:
+                if os.path.samestat(os.fstat(f.fileno()), os.stat(self.path)):
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    @_locked
+    def flush(self):
+        if not self._pending:
+            return
+        with self._lock_file() as f:
+            # Entries added by other writers since this bundle was opened
+            self._close_map()
+            self._load(open(self.path, 'rb'))
+
+            # Drop tail of an interrupted flush, then restore this state if this flush is interrupted
+            end = self._end
+            f.truncate(end)
+            f.seek(end)
+            try:
+                self._append(f)
+            except BaseException:
+                f.truncate(end)
+                self._close_map()
+                self._load(open(self.path, 'rb'))
+                raise
+            if f.tell() > COMPACT_MIN_SIZE and f.tell() > 2 * self._useful_size():
+                self._compact()
+            self._pending = {}
+            self._close_map()
+            self._load(open(self.path, 'rb'))
+
+    def _append(self, f):
+        """
+        Write pending records, synced before the index level and trailer which make them visible
+        """
+        if f.tell() == 0:
+            _write(f, MAGIC)
+        names = {}
+        level = {}
+        for name, der in self._pending.items():
+            replaced = self._find_entry(name)
+            if replaced is None:
+                self._count += 1
+            else:
+                self._live_bytes -= replaced[1]
+            raw_name = name.encode('utf-8')
+            offset = f.tell()
+            _write(f, _NAME_LEN.pack(len(raw_name)) + raw_name + _DER_LEN.pack(len(der)) + der)
+            names[offset] = name
+            level.setdefault(bundle_key(name), []).append((offset, f.tell() - offset))
+            self._live_bytes += f.tell() - offset
+
+        size = len(self._pending)
+        merged = 0
+        while merged < len(self._levels) and (self._levels[merged][1] <= 2 * size or
+                                              self._levels[merged][2] is None):
+            self._merge_level(level, names, merged)
+            size = sum(len(entries) for entries in level.values())
+            merged += 1
+        previous = self._levels[merged][2] if merged < len(self._levels) else 0
+        os.fsync(f.fileno())
+        self._write_level(f, level, previous)
+        os.fsync(f.fileno())
+
+    def _merge_level(self, level, names, idx):
+        """
+        Add entries of older index level idx to level, except records replaced by newer ones
+        """
+        for entry in range(self._levels[idx][1]):
+            key, offset, length = self._entry(idx, entry)
+            newer = level.get(key)
+            if newer is not None:
+                name = self._record(offset)[0]
+                if any((names[o] if o in names else self._record(o)[0]) == name for o, _ in newer):
+                    continue
+            level.setdefault(key, []).append((offset, length))
+
+    def _write_level(self, f, level, previous):
+        index_offset = f.tell()
+        entries = [_INDEX_ENTRY.pack(key, offset, length) for key in sorted(level) for offset, length in level[key]]
+        entries.append(_TRAILER.pack(index_offset, len(entries), previous, self._count, self._live_bytes, INDEX_MAGIC))
+        _write(f, b''.join(entries))
+
+    def _useful_size(self):
+        return len(MAGIC) + self._live_bytes + self._count * _INDEX_ENTRY.size + _TRAILER.size
+
+    def _compact(self):
+        """
+        Rewrite live records with one index into new file replacing the bundle, called with file locked
+        """
+        self._close_map()
+        self._load(open(self.path, 'rb'))
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            level = {}
+            for key, offset, length in self._live_entries():
+                level.setdefault(key, []).append((f.tell(), length))
+                f.write(self._map[offset:offset + length])
+            self._write_level(f, level, 0)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    @_locked
+    def close(self):
+        self.flush()
+        self._close_map()
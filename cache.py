@@ -0,0 +1,155 @@
+"""
+Cache of successful signature verifications.
+
+Entries are keyed by (Streebog-256 of curve params and open key, digest, r, s) bytes, only positive results
+are stored, so a cache hit can never turn a bad signature into a good one and a miss just means full verification.
+The prefix hash is computed once per open key (kept for PREFIX_CACHE_SIZE keys), so an in-memory lookup
+costs 5-10 us of byte concatenation and dict access. Lookup missing in memory also queries sqlite file
+(0.2-0.3 ms for a hit, which updates its use time), comparable to verification on 256-bit curves.
+In-memory LRU part is per process, optional sqlite file is shared by all processes using the same path.
+In-memory part is split into lock-striped shards by key, so threads checking different signatures
+rarely wait for each other; sqlite connection is used under its own lock.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from gost.gost341112 import GOST341112
+from gost.utils import long2bytes
+
+KEY_PART_SIZE = 64
+PREFIX_CACHE_SIZE = 64
+STRIPES = 16
+
+
+class _Stripe(object):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def remember(self, key):
+        self.entries[key] = True
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class VerificationCache(object):
+    def __init__(self, maxsize=4096, path=None):
+        """
+        :param maxsize: max entries kept in memory and in file
+        :param path: optional sqlite file to persist and share entries between processes
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self._stripes = [_Stripe(max(maxsize // STRIPES, 1)) for _ in range(STRIPES)]
+        self._prefixes = OrderedDict()
+        self._prefix_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        # sqlite connections must not cross fork, reopen in child processes
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS verified (key BLOB PRIMARY KEY, used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS verified_used ON verified (used)')
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _prefix(self, curve_params, pub):
+        prefix_key = (tuple(curve_params), tuple(pub))
+        prefix = self._prefixes.get(prefix_key)
+        if prefix is None:
+            data = b''.join(long2bytes(v, KEY_PART_SIZE) for v in prefix_key[0] + prefix_key[1])
+            prefix = GOST341112(data, digest_size=256).digest()
+            self._prefixes[prefix_key] = prefix
+            if len(self._prefixes) > PREFIX_CACHE_SIZE:
+                self._prefixes.popitem(last=False)
+        return prefix
+
+    def key(self, curve_params, pub, dgst, signature):
+        """
+        Cache key for verification of signature (r, s) of digest by open key on curve (p, q, a, b, x, y)
+        """
+        with self._prefix_lock:
+            prefix = self._prefix(curve_params, pub)
+        return prefix + bytes(dgst) + long2bytes(signature[0], KEY_PART_SIZE) + long2bytes(signature[1], KEY_PART_SIZE)
+
+    @property
+    def hits(self):
+        return sum(stripe.hits for stripe in self._stripes)
+
+    @property
+    def misses(self):
+        return sum(stripe.misses for stripe in self._stripes)
+
+    def _stripe(self, key):
+        # Last byte of s, prefix is the same for all signatures of one key
+        return self._stripes[key[-1] % STRIPES]
+
+    def get(self, key):
+        """
+        True if verification with this key succeeded before
+        """
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key in stripe.entries:
+                stripe.entries.move_to_end(key)
+                stripe.hits += 1
+                return True
+        found = False
+        if self.path:
+            with self._db_lock:
+                db = self._connection()
+                found = db.execute('SELECT 1 FROM verified WHERE key = ?', (key,)).fetchone() is not None
+                if found:
+                    db.execute('UPDATE verified SET used = ? WHERE key = ?', (time.time(), key))
+        with stripe.lock:
+            if found:
+                stripe.remember(key)
+                stripe.hits += 1
+            else:
+                stripe.misses += 1
+        return found
+
+    def put(self, key):
+        """
+        Remember successful verification
+        """
+        stripe = self._stripe(key)
+        with stripe.lock:
+            stripe.remember(key)
+        if self.path:
+            with self._db_lock:
+                db = self._connection()
+                db.execute('INSERT OR REPLACE INTO verified (key, used) VALUES (?, ?)', (key, time.time()))
+                db.execute(
+                    'DELETE FROM verified WHERE key IN '
+                    '(SELECT key FROM verified ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.maxsize,)
+                )
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': sum(len(s.entries) for s in self._stripes)}
+
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.hits = stripe.misses = 0
+        if self.path:
+            with self._db_lock:
+                self._connection().execute('DELETE FROM verified')
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
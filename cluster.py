@@ -0,0 +1,571 @@
+"""
+Distributed verification: coordinator hands out chunks of files to workers over TCP.
+
+Protocol is newline-delimited JSON, every worker message gets exactly one reply:
+
+    {"op": "hello", "worker": id}       -> {"heartbeat": seconds, "pubkey": [x, y] | null, "bundle": path | null}
+    {"op": "work", "worker": id}        -> {"items": [path, ...]} | {"wait": seconds} | {"done": true}
+    {"op": "result", "worker": id, "path": path, "ok": bool | null, "stage": str | null, "error": str | null} -> {}
+    {"op": "heartbeat", "worker": id}   -> {}
+
+Every reply also carries "revoked": paths taken away from this worker (stolen by an idle worker),
+and "reset": true when the coordinator has declared the worker dead and forgot its items.
+Paths are relative to the tree root, every worker maps them onto its own root.
+When the coordinator has a shared token, every message must carry it as "token", otherwise
+the connection gets {"error": ...} and is closed. Coordinator listens on 127.0.0.1 unless told otherwise.
+
+Workers process their chunk in order, so when the queue is empty the coordinator gives an idle worker
+the tail half of the busiest worker's outstanding chunk. Workers which disconnect or stay silent longer
+than timeout are dead, their outstanding items are requeued, an item lost max_attempts times is reported
+as an error. Results are idempotent: the first result for a path wins, late duplicates (from stolen or
+requeued items) are counted and ignored, as are results for paths not assigned to the reporting worker.
+Results for paths which are not items get an error reply.
+"""
+import hmac
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from multiprocessing import Process
+
+from bundle import MAGIC as BUNDLE_MAGIC, SignatureBundle
+from cache import VerificationCache
+from core import verify_file, VerificationError, RejectedError
+from watch import MANIFEST_NAME
+
+DEFAULT_BIND = '127.0.0.1:7340'
+DEFAULT_CHUNK_SIZE = 16
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_ATTEMPTS = 3
+IDLE_WAIT = 0.2
+
+
+# Sqlite keeps these next to the database
+_DB_SUFFIXES = ('', '-journal', '-wal', '-shm')
+
+
+def walk_tree(root, exclude=()):
+    """
+    Files under root which need signature check, largest first. Files owned by the tools are skipped:
+    .sign files, watch manifest, bundles (recognized by magic) and their .tmp files
+    :param exclude: other tool files, e.g. verification cache database (with its journal files)
+    """
+    skipped = set(os.path.abspath(path) + suffix for path in exclude for suffix in _DB_SUFFIXES + ('.tmp',))
+    items = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in filenames:
+            if filename.endswith(('.sign', '.sign.tmp')) or filename in (MANIFEST_NAME, MANIFEST_NAME + '.tmp'):
+                continue
+            path = os.path.join(dirpath, filename)
+            if os.path.abspath(path) in skipped or _is_bundle(path):
+                continue
+            items.append((os.path.getsize(path), os.path.relpath(path, root)))
+    items.sort(key=lambda item: (-item[0], item[1]))
+    return [path for _, path in items]
+
+
+def _is_bundle(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+    except OSError:
+        return False
+
+
+def read_manifest(path):
+    """
+    File paths listed in manifest, one per line, lines starting with # are skipped
+    """
+    with open(path) as manifest:
+        return [line.strip() for line in manifest if line.strip() and not line.startswith('#')]
+
+
+def bundle_items(root, bundle_path):
+    """
+    Files signed in bundle, relative to root
+    """
+    bundle_dir = os.path.relpath(os.path.dirname(os.path.abspath(bundle_path)), os.path.abspath(root))
+    with SignatureBundle(bundle_path) as bundle:
+        return [os.path.normpath(os.path.join(bundle_dir, name)) for name in sorted(bundle.names())]
+
+
+class Coordinator(object):
+    """
+    Hands out work to workers and merges their results into one report
+    """
+
+    def __init__(self, items, address=('127.0.0.1', 0), chunk_size=DEFAULT_CHUNK_SIZE, timeout=DEFAULT_TIMEOUT,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, pubkey=None, bundle=None, token=None):
+        """
+        :param items: file paths relative to tree root
+        :param pubkey: open key workers check signatures against, key from signature by default
+        :param bundle: bundle path relative to tree root, [path].sign files by default
+        :param token: shared secret workers must send with every message
+        """
+        self.items = list(dict.fromkeys(items))
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.pubkey = [int(v) for v in pubkey] if pubkey else None
+        self.bundle = bundle
+        self.token = token
+        self.duplicates = 0
+        self.unassigned = 0
+        self.stolen = 0
+        self.requeued = 0
+        self._items = set(self.items)
+        self._queue = deque(self.items)
+        self._lost = {}
+        self._assigned = {}
+        self._revoked = {}
+        self._seen = {}
+        self._results = {}
+        self._cond = threading.Condition()
+        self._server = socketserver.ThreadingTCPServer(address, _Handler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.allow_reuse_address = True
+        self._server.coordinator = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    @property
+    def done(self):
+        with self._cond:
+            return len(self._results) == len(self.items)
+
+    def start(self):
+        self._server.server_bind()
+        self._server.server_activate()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='coordinator', daemon=True)
+        self._thread.start()
+        return self.address
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def wait(self, timeout=None):
+        """
+        Wait until every item has a result, returns False on timeout
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while len(self._results) < len(self.items):
+                self._reap()
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(min(1, remaining) if remaining is not None else 1)
+        return True
+
+    def handle(self, msg):
+        """
+        Reply to worker message
+        """
+        op = msg.get('op')
+        worker = msg.get('worker')
+        with self._cond:
+            self._reap()
+            reply = {}
+            if op == 'hello' or worker not in self._assigned:
+                if op != 'hello':
+                    # Worker was declared dead but came back, its old items are already requeued
+                    reply['reset'] = True
+                self._assigned[worker] = deque()
+                self._revoked[worker] = set()
+            self._seen[worker] = time.time()
+
+            if op == 'hello':
+                reply.update(heartbeat=self.timeout / 3.0, pubkey=self.pubkey, bundle=self.bundle)
+            elif op == 'work':
+                items = self._take(worker)
+                if items:
+                    reply['items'] = items
+                elif len(self._results) == len(self.items):
+                    reply['done'] = True
+                else:
+                    reply['wait'] = IDLE_WAIT
+            elif op == 'result':
+                error = self._record(worker, msg)
+                if error:
+                    reply['error'] = error
+            elif op != 'heartbeat':
+                reply['error'] = 'Unknown op {0}'.format(op)
+
+            reply['revoked'] = sorted(self._revoked[worker])
+            self._revoked[worker].clear()
+            return reply
+
+    def authorized(self, msg):
+        """
+        True if message carries the shared token (or coordinator has none)
+        """
+        if self.token is None:
+            return True
+        token = msg.get('token')
+        return isinstance(token, str) and hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    def lost(self, worker):
+        """
+        Worker connection closed, requeue its outstanding items
+        """
+        with self._cond:
+            if worker in self._assigned:
+                self._drop(worker)
+
+    def _take(self, worker):
+        items = []
+        while self._queue and len(items) < self.chunk_size:
+            path = self._queue.popleft()
+            if path not in self._results:
+                items.append(path)
+        if not items:
+            items = self._steal(worker)
+        self._assigned[worker].extend(items)
+        self._revoked[worker].difference_update(items)
+        return items
+
+    def _steal(self, thief):
+        victims = [w for w in self._assigned if w != thief and len(self._assigned[w]) > 1]
+        if not victims:
+            return []
+        victim = max(victims, key=lambda w: len(self._assigned[w]))
+        assigned = self._assigned[victim]
+        # Head of the chunk is being verified by victim right now, take the tail half
+        stolen = [assigned.pop() for _ in range(len(assigned) // 2)]
+        stolen.reverse()
+        self._revoked[victim].update(stolen)
+        self.stolen += len(stolen)
+        return stolen
+
+    def _record(self, worker, msg):
+        """
+        Store result of path verified by worker, returns error message for the reply if path is not an item
+        """
+        path = msg.get('path')
+        if not isinstance(path, str) or path not in self._items:
+            return 'Unknown path {0}'.format(path)
+        if path in self._results:
+            self.duplicates += 1
+            return None
+        if path not in self._assigned[worker]:
+            # Revoked, requeued after the worker was declared dead, or never handed out to it
+            self.unassigned += 1
+            return None
+        self._results[path] = {
+            'path': path,
+            'ok': msg.get('ok'),
+            'stage': msg.get('stage'),
+            'error': msg.get('error'),
+            'worker': worker,
+            'attempts': self._lost.get(path, 0) + 1,
+        }
+        for other, assigned in self._assigned.items():
+            if path in assigned:
+                assigned.remove(path)
+                if other != worker:
+                    self._revoked[other].add(path)
+        self._cond.notify_all()
+        return None
+
+    def _reap(self):
+        now = time.time()
+        for worker, seen in list(self._seen.items()):
+            if now - seen > self.timeout:
+                self._drop(worker)
+
+    def _drop(self, worker):
+        assigned = self._assigned.pop(worker, ())
+        self._revoked.pop(worker, None)
+        self._seen.pop(worker, None)
+        for path in reversed(assigned):
+            if path in self._results:
+                continue
+            self._lost[path] = self._lost.get(path, 0) + 1
+            if self._lost[path] >= self.max_attempts:
+                self._results[path] = {
+                    'path': path, 'ok': None, 'stage': None, 'worker': None, 'attempts': self._lost[path],
+                    'error': 'Workers lost {0} times'.format(self._lost[path]),
+                }
+            else:
+                self._queue.appendleft(path)
+                self.requeued += 1
+        self._cond.notify_all()
+
+    def report(self):
+        """
+        Results of all finished items, ordered by path
+        """
+        with self._cond:
+            return [dict(self._results[path]) for path in sorted(self._results)]
+
+    def summary(self):
+        with self._cond:
+            results = list(self._results.values())
+            return {
+                'total': len(self.items),
+                'ok': sum(1 for r in results if r['ok']),
+                'failed': sum(1 for r in results if r['ok'] is False and not r['stage']),
+                'rejected': sum(1 for r in results if r['stage']),
+                'errors': sum(1 for r in results if r['ok'] is None),
+                'pending': len(self.items) - len(results),
+                'stolen': self.stolen,
+                'requeued': self.requeued,
+                'duplicates': self.duplicates,
+                'unassigned': self.unassigned,
+            }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        worker = None
+        try:
+            for line in self.rfile:
+                msg = json.loads(line.decode('utf-8'))
+                if not isinstance(msg, dict) or not coordinator.authorized(msg):
+                    self.wfile.write((json.dumps({'error': 'Not authorized'}) + '\n').encode('utf-8'))
+                    break
+                worker = msg.get('worker', worker)
+                reply = coordinator.handle(msg)
+                self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+        except (OSError, ValueError):
+            pass
+        finally:
+            if worker is not None:
+                coordinator.lost(worker)
+
+
+class _Connection(object):
+    def __init__(self, address, worker, token=None):
+        self.worker = worker
+        self.token = token
+        self._sock = socket.create_connection(address)
+        self._file = self._sock.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def call(self, op, **kwargs):
+        kwargs.update(op=op, worker=self.worker)
+        if self.token is not None:
+            kwargs['token'] = self.token
+        with self._lock:
+            self._file.write((json.dumps(kwargs) + '\n').encode('utf-8'))
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError('Coordinator closed connection')
+        reply = json.loads(line.decode('utf-8'))
+        if 'error' in reply and op == 'hello':
+            raise ConnectionError('Coordinator refused worker: {0}'.format(reply['error']))
+        return reply
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def verify_item(path, pubkey=None, bundle=None, cache=None):
+    """
+    Check one file, returns result fields of the protocol. Missing signature is an error (ok is None)
+    """
+    try:
+        result = verify_file(path, own_pubkey=pubkey, bundle=bundle, cache=cache)
+        if result.signature is None:
+            return {'ok': None, 'stage': None, 'error': result.message}
+        return {'ok': bool(result), 'stage': None, 'error': result.message}
+    except RejectedError as e:
+        return {'ok': False, 'stage': e.stage, 'error': str(e)}
+    except VerificationError as e:
+        return {'ok': None, 'stage': None, 'error': str(e)}
+
+
+def run_worker(address, root='.', worker=None, cache_path=None, token=None):
+    """
+    Pull and verify items until coordinator reports that all work is done
+    :param token: shared secret of the coordinator
+    :return: number of items verified by this worker
+    """
+    worker = worker or '{0}-{1}'.format(socket.gethostname(), os.getpid())
+    conn = _Connection(address, worker, token)
+    hello = conn.call('hello')
+    pubkey = tuple(hello['pubkey']) if hello.get('pubkey') else None
+    bundle = SignatureBundle(os.path.join(root, hello['bundle'])) if hello.get('bundle') else None
+    cache = VerificationCache(path=cache_path) if cache_path else None
+    local = deque()
+    revoked = set()
+    stopped = threading.Event()
+
+    def apply(reply):
+        if reply.get('reset'):
+            local.clear()
+        revoked.update(reply.get('revoked', ()))
+        return reply
+
+    def heartbeat():
+        while not stopped.wait(hello['heartbeat']):
+            try:
+                apply(conn.call('heartbeat'))
+            except (OSError, ValueError):
+                return
+
+    beat = threading.Thread(target=heartbeat, name='heartbeat', daemon=True)
+    beat.start()
+    verified = 0
+    try:
+        while True:
+            if not local:
+                reply = apply(conn.call('work'))
+                if reply.get('done'):
+                    break
+                if reply.get('wait'):
+                    time.sleep(reply['wait'])
+                revoked.difference_update(reply.get('items', ()))
+                local.extend(reply.get('items', ()))
+                continue
+            path = local.popleft()
+            if path in revoked:
+                revoked.discard(path)
+                continue
+            result = verify_item(os.path.join(root, path), pubkey, bundle, cache)
+            verified += 1
+            apply(conn.call('result', path=path, **result))
+    finally:
+        stopped.set()
+        conn.close()
+        if bundle is not None:
+            bundle.close()
+        if cache is not None:
+            cache.close()
+    return verified
+
+
+def run_local(items, root='.', workers=2, cache_path=None, timeout=None, **kwargs):
+    """
+    Coordinator and worker processes on this host, crashed workers are restarted.
+    Returns coordinator, check coordinator.done when timeout is given
+    """
+    # Other users of the host can connect to the loopback port too
+    kwargs.setdefault('token', secrets.token_hex(16))
+    coordinator = Coordinator(items, **kwargs)
+    address = coordinator.start()
+
+    def spawn(i):
+        process = Process(
+            target=run_worker, args=(address, root, 'local-{0}'.format(i), cache_path, coordinator.token), daemon=True
+        )
+        process.start()
+        return process
+
+    deadline = time.time() + timeout if timeout is not None else None
+    processes = []
+    try:
+        processes = [spawn(i) for i in range(workers)]
+        while not coordinator.wait(1):
+            if deadline is not None and time.time() > deadline:
+                break
+            for i, process in enumerate(processes):
+                if process.exitcode:
+                    processes[i] = spawn(i)
+    finally:
+        for process in processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        coordinator.stop()
+    return coordinator
+
+
+def format_result(result):
+    if result['ok']:
+        return '{0}: OK'.format(result['path'])
+    if result['stage']:
+        return '{0}: REJECTED ({1})'.format(result['path'], result['error'])
+    if result['ok'] is False:
+        if result['error']:
+            return '{0}: FAILED ({1})'.format(result['path'], result['error'])
+        return '{0}: FAILED'.format(result['path'])
+    return '{0}: error checking signature ({1})'.format(result['path'], result['error'])
+
+
+def _address(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Distributed GOST 34.10-2012 signature verification')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    for name in ('coordinator', 'local'):
+        command = commands.add_parser(name)
+        source = command.add_mutually_exclusive_group()
+        source.add_argument('--manifest', help='file with paths to check, one per line')
+        source.add_argument('--bundle', help='check every file signed in bundle')
+        command.add_argument('--root', default='.', help='tree root, walked when no manifest or bundle given')
+        command.add_argument('--pubkey', help='expected open key, hex x:y')
+        command.add_argument('--chunk', type=int, default=DEFAULT_CHUNK_SIZE)
+        command.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds before worker is dead')
+        command.add_argument('--report', help='write JSON report to file')
+    commands.choices['coordinator'].add_argument('--bind', default=DEFAULT_BIND, help='host:port to listen')
+    commands.choices['coordinator'].add_argument(
+        '--token', default=os.environ.get('GOST_CLUSTER_TOKEN'),
+        help='shared secret workers must send, $GOST_CLUSTER_TOKEN by default, required with non-loopback --bind'
+    )
+    commands.choices['local'].add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    commands.choices['local'].add_argument('--cache', help='sqlite verification cache shared by workers')
+    worker_parser = commands.add_parser('worker')
+    worker_parser.add_argument('address', help='coordinator host:port')
+    worker_parser.add_argument('--root', default='.')
+    worker_parser.add_argument('--cache', help='sqlite verification cache')
+    worker_parser.add_argument('--token', default=os.environ.get('GOST_CLUSTER_TOKEN'),
+                               help='shared secret of the coordinator, $GOST_CLUSTER_TOKEN by default')
+    args = parser.parse_args()
+
+    loopback = ('127.0.0.1', 'localhost', '::1')
+    if args.command == 'coordinator' and not args.token and _address(args.bind)[0] not in loopback:
+        parser.error('--token (or $GOST_CLUSTER_TOKEN) is required to listen on {0}'.format(args.bind))
+    if args.command == 'worker':
+        print('Verified {0} files'.format(
+            run_worker(_address(args.address), args.root, cache_path=args.cache, token=args.token)
+        ))
+    else:
+        if args.manifest:
+            paths = read_manifest(args.manifest)
+        elif args.bundle:
+            paths = bundle_items(args.root, args.bundle)
+        else:
+            paths = walk_tree(args.root, [args.cache] if getattr(args, 'cache', None) else ())
+        options = dict(
+            chunk_size=args.chunk, timeout=args.timeout,
+            pubkey=[int(v, 16) for v in args.pubkey.split(':')] if args.pubkey else None,
+            bundle=os.path.relpath(args.bundle, args.root) if args.bundle else None,
+        )
+        if args.command == 'local':
+            coordinator = run_local(paths, args.root, args.workers, args.cache, **options)
+        else:
+            coordinator = Coordinator(paths, address=_address(args.bind), token=args.token, **options)
+            print('Coordinator listening on {0}:{1}, {2} files'.format(*(coordinator.start() + (len(paths),))))
+            try:
+                coordinator.wait()
+            finally:
+                coordinator.stop()
+        report = coordinator.report()
+        for result in report:
+            print(format_result(result))
+        print(', '.join('{0} {1}'.format(k, v) for k, v in sorted(coordinator.summary().items())))
+        if args.report:
+            with open(args.report, 'w') as report_f:
+                json.dump({'summary': coordinator.summary(), 'results': report}, report_f, indent=2)
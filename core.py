@@ -1,10 +1,17 @@
 from binascii import hexlify
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+import time
 from os.path import exists, basename
 
-from pyasn1.codec.der import encoder, decoder
+from pyasn1.codec.der import encoder
+from pyasn1.error import PyAsn1Error
 
-from structs import SignatureSequence
+from structs import CoSignedSequence, CoSignerSequence, CurveSequence, KeyDataSet, SignatureSequence, \
+    decode_signature, encode_signature
 from gost import gost341012
+from pipeline import DEFAULT_CHUNK_SIZE, ReadAhead, hash_chunks
 
 
 def md5sum(data):
@@ -21,7 +28,13 @@ def gost34112012256(data):
     return dgst.digest()
 
 
+def gost34112012256_hasher():
+    from gost.gost341112 import GOST341112
+    return GOST341112(digest_size=256)
+
+
 default_dgstr = gost34112012256
+default_hasher = gost34112012256_hasher
 
 
 class CryptoError(Exception):
@@ -40,12 +53,102 @@ class SigningError(CryptoError):
     """Raised when signature creation fails."""
 
 
-def create_signature(curve, prv, dgst, filename='', filesize=0):
-    signature = gost341012.sign(curve, prv, dgst, 2012)
-    pub = gost341012.public_key(curve, prv)
-    s = SignatureSequence()
+class SignResult(object):
+    """
+    Created signature: digest, SignatureSequence, its DER and stage timings (seconds).
+    Human readable output is rendered only by render().
+    """
 
-    params = s.getComponentByName('params').getComponentByName('keydatasquence')
+    def __init__(self, path, dgst, signature, der, timings):
+        self.path = path
+        self.dgst = dgst
+        self.signature = signature
+        self.der = der
+        self.timings = timings
+
+    @property
+    def r(self):
+        return int(self.signature.getComponentByName('sign').getComponentByName('r'))
+
+    @property
+    def s(self):
+        return int(self.signature.getComponentByName('sign').getComponentByName('s'))
+
+    @property
+    def filename(self):
+        return str(self.signature.getComponentByName('meta').getComponentByName('filename'))
+
+    @property
+    def filesize(self):
+        return int(self.signature.getComponentByName('meta').getComponentByName('filesize'))
+
+    def render(self):
+        return 'Message hash: {0}\n\nGenerated ASN.1 file:\n\n{1}'.format(
+            hexlify(self.dgst).decode('ascii'), self.signature.prettyPrint()
+        )
+
+    __str__ = render
+
+
+class VerifyResult(object):
+    """
+    Result of file verification, true if signature is valid. Holds SignatureSequence (None if not found),
+    digest, message explaining failure, stage timings (seconds) and, for co-signature containers, list of
+    (open key, valid) of all signers. Human readable output is rendered by render().
+    """
+
+    def __init__(self, path, ok, signature=None, dgst=None, message=None, timings=None, signers=None):
+        self.path = path
+        self.ok = ok
+        self.signature = signature
+        self.dgst = dgst
+        self.message = message
+        self.timings = timings or {}
+        self.signers = signers
+
+    def __bool__(self):
+        return bool(self.ok)
+
+    def render(self):
+        parts = []
+        if self.signature is not None:
+            parts.append('Read ASN.1 file:\n\n' + self.signature.prettyPrint())
+        if self.signers:
+            parts.append('Valid signatures: {0} of {1}'.format(valid_count(self.signers), len(self.signers)))
+        if self.message:
+            parts.append(self.message)
+        return '\n'.join(parts)
+
+    __str__ = render
+
+
+# Verification stages, cheap checks go first so wrong signature is rejected before hashing
+STAGE_DECODE = 'decode'
+STAGE_PARAMS = 'params'
+STAGE_FILESIZE = 'filesize'
+STAGE_SIGNATURE = 'signature'
+
+
+class RejectedError(VerificationError):
+    """Raised when signature is rejected before EC check, stage tells which check failed."""
+
+    def __init__(self, stage, message):
+        # Both in args, so the error survives pickling between pool processes
+        super(RejectedError, self).__init__(stage, str(message))
+        self.stage = stage
+        self.message = str(message)
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.stage, self.message)
+
+
+def key_data_set(curve, pub):
+    """
+    Build KeyDataSet block with open key and curve params
+    """
+    keydata = KeyDataSet()
+
+    params = keydata.getComponentByName('keydatasquence')
     params.setComponentByName('text', 'gostSignKey')
     params.setComponentByName('algo', b'80060700')
     openkey = params.getComponentByName('open_key')
@@ -64,6 +167,12 @@ def create_signature(curve, prv, dgst, filename='', filesize=0):
     dotsparams.setComponentByName('y', curve.y)
 
     params.setComponentByName('q', curve.q)
+    return keydata
+
+
+def signature_sequence(keydata, signature, filename='', filesize=0):
+    s = SignatureSequence()
+    s.setComponentByName('params', keydata)
 
     sign = s.getComponentByName('sign')
     sign.setComponentByName('r', signature[0])
@@ -75,78 +184,459 @@ def create_signature(curve, prv, dgst, filename='', filesize=0):
     return s
 
 
-def verify_signature(dgst, s, own_pubkey=None):
-    try:
-        params = s.getComponentByName('params').getComponentByName('keydatasquence')
+def curve_sequence(curve):
+    """
+    Build CurveSequence block with curve params
+    """
+    block = CurveSequence()
+    block.getComponentByName('cryptosystem_p').setComponentByName('p', curve.p)
+    curveparams = block.getComponentByName('curve_p')
+    curveparams.setComponentByName('a', curve.a)
+    curveparams.setComponentByName('b', curve.b)
+    dotsparams = block.getComponentByName('dots_p')
+    dotsparams.setComponentByName('x', curve.x)
+    dotsparams.setComponentByName('y', curve.y)
+    block.setComponentByName('q', curve.q)
+    return block
+
+
+def cosignature_sequence(signed, filename='', filesize=0, keydata=None):
+    """
+    Build co-signature container of signatures of the same digest, curves of co-signers are stored once
+    :param signed: list of (curve, open key, (r, s)), the first one is the primary signer
+    :param keydata: KeyDataSet of the primary signer if already built
+    """
+    curve, pub, signature = signed[0]
+    plain = signature_sequence(keydata or key_data_set(curve, pub), signature, filename, filesize)
+    if len(signed) == 1:
+        return plain
+
+    s = CoSignedSequence()
+    for name in ('params', 'sign', 'meta'):
+        s.setComponentByName(name, plain.getComponentByName(name))
+    cosign = s.getComponentByName('cosign')
+    curves = cosign.getComponentByName('curves')
+    signers = cosign.getComponentByName('signers')
+    # Empty list must be a value too, co-signers often share curve of the primary signer
+    curves.clear()
+    signers.clear()
+    indexes = {tuple(curve): 0}
+    for curve, pub, signature in signed[1:]:
+        if tuple(curve) not in indexes:
+            indexes[tuple(curve)] = len(indexes)
+            curves.append(curve_sequence(curve))
+        signer = CoSignerSequence()
+        signer.setComponentByName('curve', indexes[tuple(curve)])
+        openkey = signer.getComponentByName('open_key')
+        openkey.setComponentByName('x', pub[0])
+        openkey.setComponentByName('y', pub[1])
+        sign = signer.getComponentByName('sign')
+        sign.setComponentByName('r', signature[0])
+        sign.setComponentByName('s', signature[1])
+        signers.append(signer)
+    return s
 
-        # params.getComponentByName('text')
-        if params.getComponentByName('algo', ) != b'80060700':
-            raise DecryptionError('Wrong signature identifier')
 
-        openkey_p = params.getComponentByName('open_key')
-        pub = int(openkey_p.getComponentByName('x')), int(openkey_p.getComponentByName('y'))
+def create_signature(curve, prv, dgst, filename='', filesize=0):
+    signature = gost341012.sign(curve, prv, dgst, 2012)
+    pub = gost341012.public_key(curve, prv)
+    return signature_sequence(key_data_set(curve, pub), signature, filename, filesize)
+
 
-        if own_pubkey and pub != own_pubkey:
-            print('\nOpen keys does not match!')
-            return False
+def parse_signature(s):
+    """
+    Extract curve params (p, q, a, b, x, y), open key and (r, s) from SignatureSequence
+    """
+    params = s.getComponentByName('params').getComponentByName('keydatasquence')
 
-        p = int(params.getComponentByName('cryptosystem_p').getComponentByName('p'))
-        q = int(params.getComponentByName('q'))
-        a = int(params.getComponentByName('curve_p').getComponentByName('a'))
-        b = int(params.getComponentByName('curve_p').getComponentByName('b'))
-        x = int(params.getComponentByName('dots_p').getComponentByName('x'))
-        y = int(params.getComponentByName('dots_p').getComponentByName('y'))
-        # Curve parameters are the following: p, q, a, b, x, y
+    # params.getComponentByName('text')
+    if params.getComponentByName('algo', ) != b'80060700':
+        raise DecryptionError('Wrong signature identifier')
+
+    openkey_p = params.getComponentByName('open_key')
+    pub = int(openkey_p.getComponentByName('x')), int(openkey_p.getComponentByName('y'))
+
+    p = int(params.getComponentByName('cryptosystem_p').getComponentByName('p'))
+    q = int(params.getComponentByName('q'))
+    a = int(params.getComponentByName('curve_p').getComponentByName('a'))
+    b = int(params.getComponentByName('curve_p').getComponentByName('b'))
+    x = int(params.getComponentByName('dots_p').getComponentByName('x'))
+    y = int(params.getComponentByName('dots_p').getComponentByName('y'))
+
+    signature = int(s.getComponentByName('sign').getComponentByName('r')), int(
+        s.getComponentByName('sign').getComponentByName('s'))
+
+    # Extracting some metadata
+    # metadata = s.getComponentByName('meta')
+    # filename = metadata.getComponentByName('filename')
+    # filesize = metadata.getComponentByName('filesize')
+    return (p, q, a, b, x, y), pub, signature
+
+
+def check_signature(s, own_pubkey=None, curve=None):
+    """
+    Checks done before hashing: signature structure (decode stage), open key, curve and r, s ranges (params stage)
+    :param own_pubkey: expected open key
+    :param curve: expected GOST3410Curve, by default curve is built from signature params
+    :return: (curve, open key, (r, s))
+    :raises RejectedError:
+    """
+    try:
+        curve_params, pub, signature = parse_signature(s)
+    except Exception as e:
+        raise RejectedError(STAGE_DECODE, e)
+
+    if own_pubkey and pub != tuple(own_pubkey):
+        raise RejectedError(STAGE_PARAMS, 'Open keys does not match')
+
+    if curve is None:
+        try:
+            # Curve parameters are the following: p, q, a, b, x, y
+            curve = gost341012.GOST3410Curve(*curve_params)
+        except Exception as e:
+            raise RejectedError(STAGE_PARAMS, 'Invalid curve parameters ({0})'.format(e))
+    elif curve_params != tuple(curve):
+        raise RejectedError(STAGE_PARAMS, 'Curve params does not match')
+
+    if not curve.contains(*pub):
+        raise RejectedError(STAGE_PARAMS, 'Open key is not on curve')
+    if not all(0 < v < curve.q for v in signature):
+        raise RejectedError(STAGE_PARAMS, 'Signature values out of range')
+    return curve, pub, signature
+
+
+def check_cosigners(s):
+    """
+    Checks done before hashing for co-signers of co-signature container: structure (decode stage),
+    curves, open keys and r, s ranges, every key signs once (params stage)
+    :return: list of (curve, open key, (r, s)), empty for plain signature
+    :raises RejectedError:
+    """
+    if not isinstance(s, CoSignedSequence):
+        return []
+    cosign = s.getComponentByName('cosign')
+    try:
+        curve_params, primary, _ = parse_signature(s)
+        curve_params = [curve_params]
+        for block in cosign.getComponentByName('curves'):
+            curve_params.append((
+                int(block.getComponentByName('cryptosystem_p').getComponentByName('p')),
+                int(block.getComponentByName('q')),
+                int(block.getComponentByName('curve_p').getComponentByName('a')),
+                int(block.getComponentByName('curve_p').getComponentByName('b')),
+                int(block.getComponentByName('dots_p').getComponentByName('x')),
+                int(block.getComponentByName('dots_p').getComponentByName('y')),
+            ))
+        signers = []
+        for signer in cosign.getComponentByName('signers'):
+            openkey = signer.getComponentByName('open_key')
+            sign = signer.getComponentByName('sign')
+            signers.append((
+                int(signer.getComponentByName('curve')),
+                (int(openkey.getComponentByName('x')), int(openkey.getComponentByName('y'))),
+                (int(sign.getComponentByName('r')), int(sign.getComponentByName('s'))),
+            ))
+    except Exception as e:
+        raise RejectedError(STAGE_DECODE, e)
+
+    # Quorum counts keys, the same key listed twice must not count twice
+    if len({primary} | {pub for _, pub, _ in signers}) != len(signers) + 1:
+        raise RejectedError(STAGE_PARAMS, 'Open key signed more than once')
+    curves = {}
+    checked = []
+    for idx, pub, signature in signers:
+        if not 0 <= idx < len(curve_params):
+            raise RejectedError(STAGE_DECODE, 'Unknown curve index {0} of co-signer'.format(idx))
+        if idx not in curves:
+            try:
+                curves[idx] = gost341012.GOST3410Curve(*curve_params[idx])
+            except Exception as e:
+                raise RejectedError(STAGE_PARAMS, 'Invalid curve parameters of co-signer ({0})'.format(e))
+        curve = curves[idx]
+        if not curve.contains(*pub):
+            raise RejectedError(STAGE_PARAMS, 'Open key of co-signer is not on curve')
+        if not all(0 < v < curve.q for v in signature):
+            raise RejectedError(STAGE_PARAMS, 'Signature values of co-signer out of range')
+        checked.append((curve, pub, signature))
+    return checked
+
+
+def verify_signers(checked, cosigners, dgst, verify=None, cache=None, quorum=None, signer_keys=None):
+    """
+    Check primary signature by verify(checked, dgst) and signatures of co-signers against the same digest,
+    all signatures go through cache when verify is not passed, co-signers always do
+    :param quorum: number of valid signatures required, all signatures (all signer_keys if passed) by default
+    :param signer_keys: expected open keys, only their signatures count, others are not checked
+    :return: (true if quorum reached, list of (open key, valid) of all signers, valid is None if key is not expected)
+    """
+    if quorum is not None and quorum < 1:
+        raise ValueError('Quorum must be positive, got {0}'.format(quorum))
+    if signer_keys is not None:
+        signer_keys = {tuple(pub) for pub in signer_keys}
+    if verify is None:
+        verify = partial(_verify_checked, cache=cache)
+    signers = []
+    for idx, signer in enumerate([checked] + list(cosigners)):
+        if signer_keys is not None and signer[1] not in signer_keys:
+            signers.append((signer[1], None))
+        else:
+            signers.append((signer[1], verify(signer, dgst) if idx == 0 else _verify_checked(signer, dgst, cache)))
+    if quorum is None:
+        quorum = len(signers) if signer_keys is None else len(signer_keys)
+    return valid_count(signers) >= quorum, signers
+
+
+def valid_count(signers):
+    """
+    Number of valid signatures in (open key, valid) list
+    """
+    return sum(1 for _, ok in signers if ok)
+
+
+def check_filesize(s, filepath=None, filesize=None):
+    """
+    Compare file size stored in signature with actual one (filesize stage),
+    size of filepath is used if filesize is not passed
+    :raises RejectedError:
+    """
+    expected = int(s.getComponentByName('meta').getComponentByName('filesize'))
+    actual = os.stat(filepath).st_size if filesize is None else filesize
+    if expected != actual:
+        raise RejectedError(STAGE_FILESIZE, 'File size {0} does not match signed size {1}'.format(actual, expected))
+
+
+def verify_signature(dgst, s, own_pubkey=None, cache=None):
+    """
+    Check signature structure against digest, successful results are remembered in cache if passed
+    :raises RejectedError: if signature is rejected by cheap checks
+    """
+    return _verify_checked(check_signature(s, own_pubkey), dgst, cache)
+
+
+def _verify_checked(checked, dgst, cache=None):
+    curve, pub, signature = checked
+    return _cached_verify(cache, curve, pub, dgst, signature, partial(gost341012.verify, curve))
+
+
+def _cached_verify(cache, curve, pub, dgst, signature, verify):
+    if cache is None:
+        return verify(pub, dgst, signature)
+    key = cache.key(tuple(curve), pub, dgst, signature)
+    if cache.get(key):
+        return True
+    is_verified = verify(pub, dgst, signature)
+    if is_verified:
+        cache.put(key)
+    return is_verified
+
+
+def hash_file(path, dgst_f=None, progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compute file digest, returns (digest, filesize).
+    By default file is read by background ReadAhead thread while default_hasher consumes chunks,
+    custom dgst_f gets whole file content at once.
+    """
+    if dgst_f is not None:
+        with open(path, 'rb') as file:
+            data = file.read()
+        return dgst_f(data), len(data)
+    reader = ReadAhead(path, chunk_size)
+    dgst = hash_chunks(reader, default_hasher(), progress)
+    return dgst, reader.size
 
-        curve = gost341012.GOST3410Curve(p, q, a, b, x, y)
 
-        signature = int(s.getComponentByName('sign').getComponentByName('r')), int(
-            s.getComponentByName('sign').getComponentByName('s'))
+def sign_file(path, curve, prv, dgst_f=None, bundle=None):
+    """
+    Sign file and write [path].sign near it, or add signature to bundle if SignatureBundle passed
+    """
+    return _sign_file(path, partial(create_signature, curve, prv), dgst_f, bundle)
 
-        # Extracting some metadata
-        # metadata = s.getComponentByName('meta')
-        # filename = metadata.getComponentByName('filename')
-        # filesize = metadata.getComponentByName('filesize')
 
+def _sign_file(path, make_signature, dgst_f, bundle, encode=encode_signature):
+    started = time.perf_counter()
+    try:
+        dgst, filesize = hash_file(path, dgst_f)
     except Exception as e:
-        raise VerificationError(e)
+        raise SigningError(e)
+    hashed = time.perf_counter() - started
+    if bundle is not None:
+        result = _sign_digest(make_signature, dgst, path, filesize, None, bundle, bundle.name_for(path), encode)
     else:
-        return gost341012.verify(curve, pub, dgst, signature)
-
-
-def sign_file(path, curve, prv, dgst_f=default_dgstr):
+        result = _sign_digest(make_signature, dgst, path, filesize, path + '.sign', None, None, encode)
+    result.timings['hash'] = hashed
+    return result
+
+
+def sign_digest(dgst, filename, filesize, curve, prv, sign_path=None, bundle=None):
+    """
+    Sign digest computed elsewhere (e.g. by hash_file on build agent), signature is the same
+    sign_file creates for the file. Signature is written to sign_path or added to bundle under filename if passed
+    (entry name is normalized, see bundle.entry_name).
+    :param dgst: Streebog digest of file content
+    :param filename: file name, only base name is stored in signature
+    :param filesize: file size in bytes
+    :return: SignResult, DER encoded SignatureSequence is in .der
+    """
+    return _sign_digest(partial(create_signature, curve, prv), dgst, filename, filesize, sign_path, bundle, filename)
+
+
+def cosign_file(path, signers, dgst_f=None, bundle=None, threads=None):
+    """
+    Hash file once and sign digest by every Signer in parallel, all signatures are stored in one co-signature
+    container [path].sign (or in bundle). The first signer is primary, verifiers unaware of co-signing check only it
+    :param threads: signing threads, one per signer by default
+    :return: SignResult of container
+    """
+    signers = list(signers)
+    return _sign_file(path, partial(_cosign, signers, threads), dgst_f, bundle, _cosign_encoder(signers))
+
+
+def cosign_digest(dgst, filename, filesize, signers, sign_path=None, bundle=None, threads=None):
+    """
+    Co-sign digest computed elsewhere, see cosign_file and sign_digest
+    """
+    signers = list(signers)
+    return _sign_digest(
+        partial(_cosign, signers, threads), dgst, filename, filesize, sign_path, bundle, filename,
+        _cosign_encoder(signers)
+    )
+
+
+def _cosign_encoder(signers):
+    return partial(encode_signature, params_der=signers[0].keydata_der) if signers else encode_signature
+
+
+def _cosign(signers, threads, dgst, filename='', filesize=0):
+    if not signers:
+        raise ValueError('No signers')
+    if len(set(signer.pub for signer in signers)) != len(signers):
+        raise ValueError('Same key passed twice')
+    with ThreadPoolExecutor(threads or len(signers)) as pool:
+        signatures = list(pool.map(lambda signer: signer.sign(dgst), signers))
+    return cosignature_sequence(
+        [(signer.curve, signer.pub, signature) for signer, signature in zip(signers, signatures)],
+        filename, filesize, keydata=signers[0].keydata
+    )
+
+
+def _sign_digest(make_signature, dgst, filename, filesize, sign_path, bundle, name, encode=encode_signature):
     try:
-        with open(path, 'rb') as file:
-            data = file.read()
-            dgst = dgst_f(data)
-            print('Message hash:', str(hexlify(dgst)))
-
-            s = create_signature(curve, prv, dgst, filename=basename(path), filesize=len(data))
-            print('\nGenerated ASN.1 file:\n')
-            print(s.prettyPrint())
-            with open(path + '.sign', 'wb') as sign_f:
-                sign_f.write(encoder.encode(s))
+        dgst = bytes(dgst)
+        if len(dgst) not in (32, 64):
+            raise ValueError('Digest must be 32 or 64 bytes, got {0}'.format(len(dgst)))
+        if int(filesize) < 0:
+            raise ValueError('Wrong file size {0}'.format(filesize))
+        started = time.perf_counter()
+        s = make_signature(dgst, filename=basename(filename), filesize=int(filesize))
+        der = encode(s)
+        signed = time.perf_counter()
+        if bundle is not None:
+            bundle.add(name, der)
+        elif sign_path:
+            with open(sign_path, 'wb') as sign_f:
+                sign_f.write(der)
     except Exception as e:
         raise SigningError(e)
     else:
-        return True
-
-
-def verify_file(filepath, dgst_f=default_dgstr, sign_path=None, own_pubkey=None):
-    if not sign_path:
+        return SignResult(filename, dgst, s, der, {'sign': signed - started, 'write': time.perf_counter() - signed})
+
+
+def read_signature(filepath, sign_path=None, bundle=None):
+    """
+    Load SignatureSequence (CoSignedSequence for co-signature container) for filepath from sign_path or bundle,
+    returns None if not found
+    """
+    if bundle is not None:
+        return bundle.get(bundle.name_for(filepath))
+    with open(sign_path, 'rb') as sign_f:
+        return decode_signature(sign_f.read())
+
+
+def verify_file(filepath, dgst_f=None, sign_path=None, own_pubkey=None, bundle=None, cache=None, quorum=None,
+                signer_keys=None):
+    """
+    Verify file signature from [filepath].sign, sign_path or bundle
+    :param own_pubkey: expected open key of the (primary) signer
+    :param quorum: for co-signature containers, number of valid signatures required, all by default
+    :param signer_keys: for co-signature containers, open keys whose signatures count towards quorum
+    :return: VerifyResult, true if signature is valid
+    :raises RejectedError: if signature is rejected before EC check
+    """
+    return _verify_file(
+        filepath, partial(check_signature, own_pubkey=own_pubkey), partial(_verify_checked, cache=cache),
+        dgst_f, sign_path, bundle, cache, quorum, signer_keys
+    )
+
+
+def _verify_file(filepath, check, verify, dgst_f, sign_path, bundle, cache=None, quorum=None, signer_keys=None):
+    if bundle is None and not sign_path:
         sign_path = filepath + '.sign'
         if not exists(sign_path):
-            print('\nCant find {0}.sign in folder, please point path to .sign file'.format(basename(filepath)))
-            return False
-
+            return VerifyResult(
+                filepath, False,
+                message='Cant find {0}.sign in folder, please point path to .sign file'.format(basename(filepath))
+            )
+    return _verify_pipeline(
+        filepath, partial(read_signature, filepath, sign_path, bundle),
+        bundle is not None and 'Cant find {0} in bundle {1}'.format(bundle.name_for(filepath), bundle.path),
+        check, partial(check_filesize, filepath=filepath), lambda: hash_file(filepath, dgst_f)[0], verify,
+        cache, quorum, signer_keys
+    )
+
+
+def verify_digest(dgst, filesize, sign_path=None, own_pubkey=None, bundle=None, name=None, cache=None, quorum=None,
+                  signer_keys=None):
+    """
+    Verify signature of file by digest and size computed elsewhere, file itself is not needed.
+    Signature is read from sign_path or from bundle by name
+    :return: VerifyResult
+    """
+    return _verify_digest(
+        dgst, filesize, partial(check_signature, own_pubkey=own_pubkey), partial(_verify_checked, cache=cache),
+        sign_path, bundle, name, cache, quorum, signer_keys
+    )
+
+
+def _verify_digest(dgst, filesize, check, verify, sign_path, bundle, name, cache=None, quorum=None,
+                   signer_keys=None):
+    if bundle is not None:
+        read = partial(bundle.get, name)
+    else:
+        read = partial(read_signature, None, sign_path)
+    return _verify_pipeline(
+        name or sign_path, read, bundle is not None and 'Cant find {0} in bundle {1}'.format(name, bundle.path),
+        check, partial(check_filesize, filesize=int(filesize)), lambda: bytes(dgst), verify, cache, quorum,
+        signer_keys
+    )
+
+
+def _verify_pipeline(path, read, missing, check, check_size, digest, verify, cache=None, quorum=None,
+                     signer_keys=None):
+    """
+    Verification pipeline: decode and check signature, compare file size, then get digest and check EC signature
+    (of every signer for co-signature container)
+    """
+    timings = {}
     try:
-        with open(filepath, 'rb') as file, open(sign_path, 'rb') as sign_f:
-            data = file.read()
-            struct, _ = decoder.decode(sign_f.read(), asn1Spec=SignatureSequence())
-            print('\nRead ASN.1 file:\n')
-            print(struct.prettyPrint())
-            dgst = dgst_f(data)
-            is_verified = verify_signature(dgst, struct, own_pubkey)
+        started = time.perf_counter()
+        try:
+            struct = read()
+        except PyAsn1Error as e:
+            raise RejectedError(STAGE_DECODE, e)
+        if struct is None:
+            return VerifyResult(path, False, message=missing)
+        checked = check(struct)
+        cosigners = check_cosigners(struct)
+        check_size(struct)
+        timings['check'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        dgst = digest()
+        timings['hash'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        is_verified, signers = verify_signers(checked, cosigners, dgst, verify, cache, quorum, signer_keys)
+        timings['verify'] = time.perf_counter() - started
 
     except VerificationError:
         raise
@@ -155,7 +645,150 @@ def verify_file(filepath, dgst_f=default_dgstr, sign_path=None, own_pubkey=None)
     except Exception as e:
         raise VerificationError(e)
     else:
-        return is_verified
+        message = None
+        if not is_verified and (cosigners or quorum or signer_keys):
+            message = 'Only {0} of {1} signatures are valid, {2} required'.format(
+                valid_count(signers), len(signers), quorum or len(signer_keys or signers)
+            )
+        return VerifyResult(path, is_verified, struct, dgst, message, timings, signers if cosigners else None)
+
+
+class Signer(object):
+    """
+    Signing context for one key: public key, KeyDataSet block, its DER (spliced into every encoded signature)
+    and curve base point table are computed once and reused by every signature.
+    Precomputed (e.g. shared, see gost.tables) table can be passed.
+    """
+
+    def __init__(self, curve, prv, window=4, base_table=None):
+        self.curve = curve
+        self.prv = prv
+        self.base_table = base_table or curve.base_table(window)
+        self.pub = gost341012.public_key(curve, prv, base_table=self.base_table)
+        self.keydata = key_data_set(curve, self.pub)
+        self.keydata_der = encoder.encode(self.keydata)
+
+    def sign(self, dgst):
+        """
+        Sign digest, returns (r, s)
+        """
+        return gost341012.sign(self.curve, self.prv, dgst, 2012, base_table=self.base_table)
+
+    def create_signature(self, dgst, filename='', filesize=0):
+        return signature_sequence(self.keydata, self.sign(dgst), filename, filesize)
+
+    def encode(self, s):
+        """
+        DER of signature created by this signer, key block is not encoded again
+        """
+        return encode_signature(s, params_der=self.keydata_der)
+
+    def sign_file(self, path, dgst_f=None, bundle=None):
+        return _sign_file(path, self.create_signature, dgst_f, bundle, self.encode)
+
+    def sign_digest(self, dgst, filename, filesize, sign_path=None, bundle=None):
+        return _sign_digest(self.create_signature, dgst, filename, filesize, sign_path, bundle, filename, self.encode)
+
+
+class Verifier(object):
+    """
+    Verification context for one open key: curve base point and open key tables are computed once.
+    Signatures made by other key or on other curve are rejected.
+    """
+
+    def __init__(self, curve, pub, window=4, cache=None, base_table=None, pub_table=None):
+        self.curve = curve
+        self.pub = tuple(pub)
+        self.cache = cache
+        self.base_table = base_table or curve.base_table(window)
+        self.pub_table = pub_table or curve.precompute(pub[0], pub[1], window=window)
+
+    def verify(self, dgst, signature):
+        """
+        Check (r, s) signature of digest
+        """
+        return _cached_verify(self.cache, tuple(self.curve), self.pub, dgst, signature, self._verify)
+
+    def _verify(self, pub, dgst, signature):
+        return gost341012.verify(
+            self.curve, pub, dgst, signature, 2012, base_table=self.base_table, pub_table=self.pub_table
+        )
+
+    def check_signature(self, s):
+        return check_signature(s, own_pubkey=self.pub, curve=self.curve)
+
+    def verify_signature(self, dgst, s):
+        """
+        :raises RejectedError: if signature is made by other key, on other curve or malformed
+        """
+        return self._verify_checked(self.check_signature(s), dgst)
+
+    def _verify_checked(self, checked, dgst):
+        return self.verify(dgst, checked[2])
+
+    def verify_file(self, filepath, dgst_f=None, sign_path=None, bundle=None, quorum=None, signer_keys=None):
+        return _verify_file(
+            filepath, self.check_signature, self._verify_checked, dgst_f, sign_path, bundle, self.cache, quorum,
+            signer_keys
+        )
+
+    def verify_digest(self, dgst, filesize, sign_path=None, bundle=None, name=None, quorum=None, signer_keys=None):
+        return _verify_digest(
+            dgst, filesize, self.check_signature, self._verify_checked, sign_path, bundle, name, self.cache, quorum,
+            signer_keys
+        )
+
+
+def verify_files(files, own_pubkey=None, bundle=None, cache=None, quorum=None, signer_keys=None):
+    """
+    Verify many files, next file is read ahead while signature of current one is checked.
+    :param files: iterable of file paths or (file path, sign path) pairs
+    :return: generator of (file path, result), result is VerifyResult or VerificationError (RejectedError for rejections)
+    """
+    items = [(f, None) if isinstance(f, str) else tuple(f) for f in files]
+
+    def start(idx):
+        if idx >= len(items):
+            return None
+        try:
+            return ReadAhead(items[idx][0])
+        except OSError as e:
+            return e
+
+    current = start(0)
+    try:
+        for idx, (filepath, sign_path) in enumerate(items):
+            upcoming = None
+            try:
+                try:
+                    struct = read_signature(filepath, sign_path or filepath + '.sign', bundle)
+                except PyAsn1Error as e:
+                    raise RejectedError(STAGE_DECODE, e)
+                if struct is None:
+                    raise VerificationError('Cant find {0} in bundle {1}'.format(bundle.name_for(filepath), bundle.path))
+                checked = check_signature(struct, own_pubkey)
+                cosigners = check_cosigners(struct)
+                check_filesize(struct, filepath)
+                if isinstance(current, Exception):
+                    raise current
+                dgst = hash_chunks(current, default_hasher())
+                upcoming = start(idx + 1)
+                is_verified, signers = verify_signers(
+                    checked, cosigners, dgst, cache=cache, quorum=quorum, signer_keys=signer_keys
+                )
+                result = VerifyResult(filepath, is_verified, struct, dgst, signers=signers if cosigners else None)
+            except VerificationError as e:
+                result = e
+            except Exception as e:
+                result = VerificationError(e)
+            finally:
+                if isinstance(current, ReadAhead):
+                    current.close()
+            current = upcoming if upcoming is not None else start(idx + 1)
+            yield filepath, result
+    finally:
+        if isinstance(current, ReadAhead):
+            current.close()
 
 
 if __name__ == '__main__':
@@ -164,5 +797,7 @@ if __name__ == '__main__':
     curve = gost341012.GOST3410Curve(*curve_params)
     prv_raw = urandom(32)
     prv = gost341012.prv_unmarshal(prv_raw)
-    sign_file('./testdata/lorem.txt', curve, prv)
-    assert verify_file('./testdata/lorem.txt')
+    print(sign_file('./testdata/lorem.txt', curve, prv))
+    result = verify_file('./testdata/lorem.txt')
+    print(result)
+    assert result
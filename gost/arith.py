@@ -0,0 +1,163 @@
+# coding: utf-8
+""" Big integer arithmetic backends
+
+Curve parameters are converted with backend.mpz() when GOST3410Curve is
+created, so all field and scalar arithmetic of that curve runs on backend
+numbers. Modular inversion and bytes deserialization are routed through
+the active backend by gost.utils.
+
+Backend is chosen at import: GOST_ARITH_BACKEND environment variable
+("python" or "gmpy2"), otherwise gmpy2 when it is installed. Use
+set_backend() to switch explicitly, curves created before keep their numbers.
+"""
+
+from os import environ
+
+
+class PythonBackend(object):
+    """ Built-in CPython integers
+    """
+    name = "python"
+    mpz = int
+
+    @staticmethod
+    def invert(a, n):
+        try:
+            return pow(a, -1, n)
+        except ValueError:
+            return -1
+
+    @staticmethod
+    def from_bytes(raw):
+        return int.from_bytes(raw, "big")
+
+
+class GmpyBackend(object):
+    """ GMP integers through gmpy2
+    """
+    name = "gmpy2"
+
+    def __init__(self):
+        import gmpy2
+        self.mpz = gmpy2.mpz
+        self._invert = gmpy2.invert
+
+    def invert(self, a, n):
+        try:
+            return self._invert(a, n)
+        except ZeroDivisionError:
+            return -1
+
+    def from_bytes(self, raw):
+        return self.mpz(int.from_bytes(raw, "big"))
+
+
+BACKENDS = {
+    PythonBackend.name: PythonBackend,
+    GmpyBackend.name: GmpyBackend,
+}
+
+backend = None
+
+
+def set_backend(name=None):
+    """ Select arithmetic backend
+
+    :param name: backend name, None selects gmpy2 if available
+    :returns: selected backend
+    :raises ImportError: if requested backend is not installed
+    """
+    global backend
+    if name is None:
+        try:
+            backend = GmpyBackend()
+        except ImportError:
+            backend = PythonBackend()
+    else:
+        backend = BACKENDS[name]()
+    return backend
+
+
+def get_backend():
+    return backend
+
+
+set_backend(environ.get("GOST_ARITH_BACKEND"))
+
+
+# Public keys for private key gost341012.prv_unmarshal(bytes(range(1, 65)))
+# and signature of digest "fe7ea13d..." for that key
+KNOWN_ANSWERS = {
+    "GostR3410_2012_TC26_ParamSetA": (
+        0x47c663b58d7d92334be3c63f9932fa9ca8a80a2ee31f52d7df20f1d94ffb141c5c01024a9df61c0dcf96b304354c7e407440a582d59558b76a1f4a9a3010576d,
+        0x14321d2e3f32178ff83ab4f5b712a695059f4e5be1525512e06bb78ec6f816122a2a3211609dba78cdff27d776f4d6dda8aabc2263cd93e5cc031cd1a534e584,
+        0x34ab235d95cfe2c5c48eb013bb91e053496470a74b63a0b6d677183203b28a71f0e62de18f448159fbcfe50565d81e253f3e86f1e6c66a14c8d33996135cf801,
+        0xade044c6889ce71693a7d79b77f89f58e065561ca04008c50ada70aafb5c1ad4cb7633ac6b7274c8cbfc952dfe2589e5257c1812ac3aa2bb4b8840ac8f1e13ef,
+    ),
+    "GostR3410_2012_TC26_ParamSetB": (
+        0x7cbc57db5bd14342d67883c03cd23d4c67c74b74a440098c3b7bd647dc9567357812ec4333a459566c4eb083c8f31e71a56416896ee6ac14b48d280c4afd2ed7,
+        0x586d111ff88c9da8c45af96ca271d4fcf975281b2af891cce2827d805dadef93acabbb0e3ed69bb43fb3f17730c4cfc0aac089871e91cda319826c882547269,
+        0x203a0c403cca11d9c0edfc0af8545038f9af8ef4ca9743ff29b6538fa05cbe0a9ba5961871e7786da79756dc4f898bc62bbf062e48811adc207057a258d88d5a,
+        0x55434b04990389e2bbcb42aced8c44c50aaa99e1bec152b8b7b575a6ed10d43b6c56e2abb0e10eee7f176ad5a44a48060e5d99418a888e4d783cc3297eed95a1,
+    ),
+    # Computed on Weierstrass form, checked on Edwards form
+    "GostR3410_2012_TC26_256_ParamSetA": (
+        0x3700765f8a840f349732392a1c0e01104f856baccfeac919706a2773ab4b9c1,
+        0x598a25784bf37d3a77a30451aad0cfc99b06c7ef8b9e0518aec7e7a1810233,
+        0x26da745f404cea80cf8f95cb0f9238ab5eef0ba0d09a7f8244ad5cbf03ed0cb8,
+        0x1f7a9bbdaf58a4b44a42283b3ec019ac4aa2b4b48b22f6189721164c50fae9da,
+    ),
+    "GostR3410_2012_TC26_ParamSetC": (
+        0xceea7189e8d31c61800c2ceaa3360bf34a0f1c36f753d162ad8fa3675631fd7fe2be383638db1271b873dcfc039bba2660f30226b291f6b1740d9800ee5db39a,
+        0x13a52435dc88b204ade977bde3886b7afcf73ebb4a4f39eb571c24ef3ded1092bedf49deb3475184153e8af7fb66906148e5ba93348b3bd8fa4b8443cf654833,
+        0x1f31117c607a5be5c80422ebc236f2abd61a44eba725286628581291d1f55823b829c3b1cf2b1d3e41ffbb9971f53d91d7ca498fddf8c1fe826aa7f662db2c40,
+        0xe833b2ef0be4815a2ba3411d6aaf5308a8debc2eb0144c6fc1c577b3f78b4f3f6b158f251affe2b7c2a42494dbba003311b67ac1c0ed3059a827f938ed5b788,
+    ),
+}
+KNOWN_ANSWER_DIGEST = "fe7ea13d871beaf1deda27aeddb7a96927ad03011282147f7e4fa2765dc83811"
+
+
+def check_known_answers():
+    """ Check public key derivation, signing and verification on every named curve
+    with current backend, raises AssertionError on mismatch
+    """
+    from . import gost341012
+    from .utils import bytes2long, hexdec, modinvert
+
+    assert bytes2long(b"\x01\x00") == 256
+    assert modinvert(3, 7) == 5 and modinvert(-3, 7) == 2 and modinvert(0, 7) == -1
+    digest = hexdec(KNOWN_ANSWER_DIGEST)
+    prv = gost341012.prv_unmarshal(bytes(range(1, 65)))
+    for name, (x, y, r, s) in KNOWN_ANSWERS.items():
+        curve = gost341012.GOST3410Curve(*gost341012.CURVE_PARAMS[name])
+        assert gost341012.public_key(curve, prv) == (x, y), name
+        assert gost341012.verify(curve, (x, y), digest, (r, s)), name
+        assert not gost341012.verify(curve, (x, y), digest, (r, s - 1)), name
+        assert gost341012.verify(curve, (x, y), digest, gost341012.sign(curve, prv, digest)), name
+
+
+if __name__ == "__main__":
+    # Known answers and per curve timings for every installed backend:
+    # python -m gost.arith
+    from timeit import timeit
+    # Module imported by the package, not this __main__ copy
+    from . import arith
+    from . import gost341012
+
+    for name in arith.BACKENDS:
+        try:
+            arith.set_backend(name)
+        except ImportError:
+            print("%s: not installed" % name)
+            continue
+        arith.check_known_answers()
+        for curve_name in sorted(gost341012.CURVE_PARAMS):
+            curve = gost341012.GOST3410Curve(*gost341012.CURVE_PARAMS[curve_name])
+            prv = gost341012.prv_unmarshal(bytes(range(1, 65)))
+            x, y, r, s = KNOWN_ANSWERS[curve_name]
+            digest = bytes.fromhex(KNOWN_ANSWER_DIGEST)
+            print("%-7s %s: public_key %.1f ms, verify %.1f ms" % (
+                name, curve_name,
+                timeit(lambda: gost341012.public_key(curve, prv), number=10) * 100,
+                timeit(lambda: gost341012.verify(curve, (x, y), digest, (r, s)), number=10) * 100,
+            ))
@@ -0,0 +1,199 @@
+# coding: utf-8
+""" Twisted Edwards form of Weierstrass curves
+
+TC26 256-bit ParamSetA and 512-bit ParamSetC curves are birationally
+equivalent (:rfc:`7836`) to twisted Edwards curves
+
+    e*u^2 + v^2 = 1 + d*u^2*v^2
+
+With s = (e - d) / 4, t = (e + d) / 6 the maps are:
+
+    (x, y) -> (u, v) = ((x - t) / y, (x - t - s) / (x - t + s))
+    (u, v) -> (x, y) = (s(1 + v) / (1 - v) + t, s(1 + v) / ((1 - v)u))
+
+Points are kept in extended coordinates (X : Y : Z : T), u = X/Z,
+v = Y/Z, uv = T/Z. Addition and doubling (Hisil, Wong, Carter, Dawson,
+2008) need no inversions and, as d is non-square, addition is complete:
+the same formula adds, doubles and handles the neutral point (0, 1).
+Only conversion back to Weierstrass form needs a single inversion.
+"""
+
+from .utils import modinvert
+
+
+class EdwardsForm(object):
+    """ Twisted Edwards point engine for Weierstrass curve over p
+    """
+
+    def __init__(self, p, e, d, reduce):
+        """
+        :param reduce: field reduction function of the Weierstrass curve
+        """
+        self.p = p
+        self.e = e
+        self.d = d
+        self.reduce = reduce
+        self.s = reduce((e - d) * modinvert(4, p))
+        self.t = reduce((e + d) * modinvert(6, p))
+
+    def weierstrass_params(self):
+        """ Weierstrass a, b of equivalent curve
+        """
+        s, t = self.s, self.t
+        return self.reduce(s * s - 3 * t * t), self.reduce(2 * t * t * t - t * s * s)
+
+    def from_weierstrass(self, x, y):
+        """ Affine Weierstrass (x, y) to affine Edwards (u, v)
+        """
+        reduce = self.reduce
+        xt = x - self.t
+        xts = reduce(xt + self.s)
+        w = modinvert(reduce(y * xts), self.p)
+        return reduce(xt * xts * w), reduce(reduce(xt - self.s) * y * w)
+
+    def to_weierstrass(self, point):
+        """ Extended Edwards point to affine Weierstrass (x, y)
+
+        :raises ValueError: for neutral point, it is infinity in Weierstrass form
+        """
+        reduce = self.reduce
+        X, Y, Z, _ = point
+        X = reduce(X)
+        if X == 0:
+            if reduce(Y - Z) == 0:
+                raise ValueError("Point at infinity")
+            # (0, -1) is the point of order 2
+            return self.t, 0
+        zy = reduce(self.s * (Z + Y))
+        w = modinvert(reduce(reduce(Z - Y) * X), self.p)
+        return reduce(zy * X * w + self.t), reduce(zy * Z * w)
+
+    def to_affine(self, points):
+        """ Extended points to affine (u, v) with single inversion
+        """
+        reduce = self.reduce
+        prefix = []
+        acc = 1
+        for point in points:
+            prefix.append(acc)
+            acc = reduce(acc * point[2])
+        inv = modinvert(acc, self.p)
+        result = [None] * len(points)
+        for i in range(len(points) - 1, -1, -1):
+            X, Y, Z, _ = points[i]
+            z_inv = reduce(inv * prefix[i])
+            inv = reduce(inv * Z)
+            result[i] = (reduce(X * z_inv), reduce(Y * z_inv))
+        return result
+
+    def neutral(self):
+        return 0, 1, 1, 0
+
+    def extended(self, u, v):
+        return u, v, 1, self.reduce(u * v)
+
+    def add(self, p1, p2):
+        reduce = self.reduce
+        X1, Y1, Z1, T1 = p1
+        X2, Y2, Z2, T2 = p2
+        A = reduce(X1 * X2)
+        B = reduce(Y1 * Y2)
+        C = reduce(reduce(self.d * T1) * T2)
+        D = reduce(Z1 * Z2)
+        E = reduce((X1 + Y1) * (X2 + Y2) - A - B)
+        F = D - C
+        G = D + C
+        H = B - self.e * A
+        return reduce(E * F), reduce(G * H), reduce(F * G), reduce(E * H)
+
+    def add_affine(self, p1, u, v):
+        """ Add affine point (u, v), saves multiplications by Z2 = 1
+        """
+        reduce = self.reduce
+        X1, Y1, Z1, T1 = p1
+        A = reduce(X1 * u)
+        B = reduce(Y1 * v)
+        C = reduce(reduce(self.d * T1) * reduce(u * v))
+        E = reduce((X1 + Y1) * (u + v) - A - B)
+        F = Z1 - C
+        G = Z1 + C
+        H = B - self.e * A
+        return reduce(E * F), reduce(G * H), reduce(F * G), reduce(E * H)
+
+    def double(self, p1):
+        reduce = self.reduce
+        X1, Y1, Z1, _ = p1
+        A = reduce(X1 * X1)
+        B = reduce(Y1 * Y1)
+        C = 2 * reduce(Z1 * Z1)
+        D = self.e * A
+        E = reduce((X1 + Y1) * (X1 + Y1) - A - B)
+        G = D + B
+        F = G - C
+        H = D - B
+        return reduce(E * F), reduce(G * H), reduce(F * G), reduce(E * H)
+
+    def mul(self, degree, u, v):
+        """ degree * (u, v), extended point
+        """
+        point = self.neutral()
+        for bit in bin(degree)[2:]:
+            point = self.double(point)
+            if bit == "1":
+                point = self.add_affine(point, u, v)
+        return point
+
+    def mul_table(self, degree, table):
+        """ degree * P for P precomputed by precompute(), extended point
+        """
+        mask = (1 << table.window) - 1
+        points = table.points
+        point = self.neutral()
+        offset = 0
+        while degree != 0:
+            digit = degree & mask
+            if digit:
+                u, v = points[offset + digit - 1]
+                point = self.add_affine(point, u, v)
+            degree >>= table.window
+            offset += mask
+        return point
+
+    def precompute(self, u, v, bits, window):
+        """ Affine (u, v) points of PointTable layout, see GOST3410Curve.precompute
+        """
+        points = []
+        base = self.extended(u, v)
+        for _ in range(0, bits, window):
+            point = base
+            points.append(point)
+            for _ in range((1 << window) - 2):
+                point = self.add(point, base)
+                points.append(point)
+            base = self.add(point, base)
+        return self.to_affine(points)
+
+
+# (p, a, b) of Weierstrass curve -> (e, d) of equivalent twisted Edwards curve
+EDWARDS_CURVES = {}
+
+
+def register_edwards(p, a, b, e, d):
+    """ Remember that curve (p, a, b) has twisted Edwards form (e, d)
+
+    :raises ValueError: if Edwards parameters do not match a, b
+    """
+    p, a, b = int(p), int(a), int(b)
+    form = EdwardsForm(p, e, d, lambda x: x % p)
+    if form.weierstrass_params() != (a % p, b % p):
+        raise ValueError("Edwards parameters do not match curve")
+    EDWARDS_CURVES[(p, a, b)] = (e, d)
+
+
+def edwards_for(p, a, b, reduce):
+    """ EdwardsForm of registered curve or None
+    """
+    params = EDWARDS_CURVES.get((int(p), int(a), int(b)))
+    if params is None:
+        return None
+    return EdwardsForm(p, params[0], params[1], reduce)
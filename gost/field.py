@@ -0,0 +1,144 @@
+# coding: utf-8
+""" Prime field reduction helpers
+
+TC26 curves use special form primes: ParamSetA p = 2^512 - 569,
+ParamSetB p = 2^511 + 111. For such p = 2^k -+ c reduction needs only
+shifts, masks and multiplication by small c instead of generic division.
+field_for() picks specialized reduction only for primes registered with
+register_prime(). No prime is registered by default: point operations are
+dominated by modular inversion and Edwards formulas reduce many small and
+negative values, so end to end shift-and-add never measurably beats x % p
+(see python -m gost.field).
+"""
+
+from . import arith
+
+
+class PrimeField(object):
+    """ Generic prime field
+    """
+
+    def __init__(self, p):
+        self.p = p
+
+    def reduce(self, x):
+        """ x mod p for any (also negative) integer x
+        """
+        return x % self.p
+
+
+class PseudoMersenneField(PrimeField):
+    """ Field of p = 2^k - c
+    """
+
+    def __init__(self, p, k, c):
+        super(PseudoMersenneField, self).__init__(p)
+        self.k = k
+        self.c = c
+        self.mask = (1 << k) - 1
+
+    def reduce(self, x):
+        if x < 0:
+            return x % self.p
+        k, c, mask = self.k, self.c, self.mask
+        # 2^k = c (mod p)
+        while x >> k:
+            x = (x & mask) + (x >> k) * c
+        if x >= self.p:
+            x -= self.p
+        return x
+
+
+class PseudoMersennePlusField(PrimeField):
+    """ Field of p = 2^k + c
+    """
+
+    def __init__(self, p, k, c):
+        super(PseudoMersennePlusField, self).__init__(p)
+        self.k = k
+        self.c = c
+        self.mask = (1 << k) - 1
+
+    def reduce(self, x):
+        k, c, mask = self.k, self.c, self.mask
+        neg = x < 0
+        if neg:
+            x = -x
+        # 2^k = -c (mod p)
+        while x >> k:
+            x = (x & mask) - (x >> k) * c
+            if x < 0:
+                x = -x
+                neg = not neg
+        # x < 2^k < p here
+        if neg and x:
+            x = self.p - x
+        return x
+
+
+def special_form(p, max_c_bits=32):
+    """ Find representation p = 2^k - c or p = 2^k + c with small c
+
+    :returns: (field class, k, c) or None
+    """
+    k = p.bit_length()
+    if (1 << k) - p < (1 << max_c_bits):
+        return PseudoMersenneField, k, (1 << k) - p
+    if p - (1 << (k - 1)) < (1 << max_c_bits):
+        return PseudoMersennePlusField, k - 1, p - (1 << (k - 1))
+    return None
+
+
+SPECIAL_PRIMES = {}
+
+
+def register_prime(p):
+    """ Use specialized reduction for p if it has special form, only worth
+    it where python -m gost.field shows a win for the whole scalar multiplication
+    """
+    form = special_form(int(p))
+    if form is not None:
+        SPECIAL_PRIMES[int(p)] = form
+
+
+def field_for(p):
+    """ Field helper for prime p: specialized for registered special primes,
+    generic otherwise. gmpy2 division is faster than shift-and-add done
+    in Python, so gmpy2 backend always gets generic field.
+    """
+    form = SPECIAL_PRIMES.get(int(p))
+    if form is None or arith.backend.name != arith.PythonBackend.name:
+        return PrimeField(p)
+    cls, k, c = form
+    return cls(p, k, c)
+
+
+if __name__ == "__main__":
+    # Field multiplication and public_key benchmark: python -m gost.field
+    from os import urandom
+    from timeit import repeat
+    from timeit import timeit
+    from . import field
+    from . import gost341012
+
+    arith.set_backend(arith.PythonBackend.name)
+    for name in sorted(gost341012.CURVE_PARAMS):
+        curve = gost341012.GOST3410Curve(*gost341012.CURVE_PARAMS[name])
+        p = curve.p
+        cls, k, c = field.special_form(p)
+        fields = [field.PrimeField(p), cls(p, k, c)]
+        a = int.from_bytes(urandom(64), "big") % p
+        b = int.from_bytes(urandom(64), "big") % p
+        prv = gost341012.prv_unmarshal(urandom(64))
+        for f in fields:
+            assert f.reduce(a * b) == a * b % p and f.reduce(a - b) == (a - b) % p
+            curve = gost341012.GOST3410Curve(*gost341012.CURVE_PARAMS[name])
+            curve.field = f
+            curve.reduce = f.reduce
+            if curve.edwards is not None:
+                curve.edwards.reduce = f.reduce
+            print("%s %-23s mul+reduce %.3f us public_key %.2f ms" % (
+                name, f.__class__.__name__,
+                timeit(lambda: f.reduce(a * b), number=200000) * 5,
+                min(repeat(lambda: gost341012.public_key(curve, prv), number=1, repeat=15)) * 1000,
+            ))
@@ -21,7 +21,11 @@ hash function and corresponding digest and signature lengths.
 """
 
 from os import urandom
+from threading import Lock
 
+from .edwards import edwards_for
+from .edwards import register_edwards
+from .field import field_for
 from .utils import bytes2long
 from .utils import hexdec
 from .utils import long2bytes
@@ -37,7 +41,8 @@ MODE2SIZE = {
 DEFAULT_CURVE = "GostR3410_2012_TC26_ParamSetA"
 # Curve parameters are the following: p, q, a, b, x, y
 CURVE_PARAMS_TEXT = {
-    # Curve params truncated, only params defined in GOSTR3410_2012 whitepaper here.
+    # Curve params truncated, only params defined in GOSTR3410_2012 whitepaper
+    # and TC26 curves with twisted Edwards form (RFC 7836) here.
     # For more curve params visit http://git.cypherpunks.ru/cgit.cgi/pygost.git/tree/pygost/gost3410.py#n121
     "GostR3410_2012_TC26_ParamSetA": (
         "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFDC7",
@@ -55,17 +60,68 @@ CURVE_PARAMS_TEXT = {
         "00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000002",
         "1A8F7EDA389B094C2C071E3647A8940F3C123B697578C213BE6DD9E6C8EC7335DCB228FD1EDF4A39152CBCAAF8C0398828041055F94CEEEC7E21340780FE41BD"
     ),
+    "GostR3410_2012_TC26_256_ParamSetA": (
+        "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFD97",
+        "400000000000000000000000000000000FD8CDDFC87B6635C115AF556C360C67",
+        "C2173F1513981673AF4892C23035A27CE25E2013BF95AA33B22C656F277E7335",
+        "295F9BAE7428ED9CCC20E7C359A9D41A22FCCD9108E17BF7BA9337A6F8AE9513",
+        "91E38443A5E82C0D880923425712B2BB658B9196932E02C78B2582FE742DAA28",
+        "32879423AB1A0375895786C4BB46E9565FDE0B5344766740AF268ADB32322E5C",
+    ),
+    "GostR3410_2012_TC26_ParamSetC": (
+        "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFDC7",
+        "3FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFC98CDBA46506AB004C33A9FF5147502CC8EDA9E7A769A12694623CEF47F023ED",
+        "DC9203E514A721875485A529D2C722FB187BC8980EB866644DE41C68E143064546E861C0E2C9EDD92ADE71F46FCF50FF2AD97F951FDA9F2A2EB6546F39689BD3",
+        "B4C4EE28CEBC6C2C8AC12952CF37F16AC7EFB6A9F69F4B57FFDA2E4F0DE5ADE038CBC2FFF719D2C18DE0284B8BFEF3B52B8CC7A5F5BF0A3C8D2319A5312557E1",
+        "E2E31EDFC23DE7BDEBE241CE593EF5DE2295B7A9CBAEF021D385F7074CEA043AA27272A7AE602BF2A7B9033DB9ED3610C6FB85487EAE97AAC5BC7928C1950148",
+        "F5CE40D95B5EB899ABBCCFF5911CB8577939804D6527378B8C108C3D2090FF9BE18E2D33E3021ED2EF32D85822423B6304F726AA854BAE07D0396E9A9ADDC40F",
+    ),
+}
+# Twisted Edwards curve params: e, d
+CURVE_EDWARDS_TEXT = {
+    "GostR3410_2012_TC26_256_ParamSetA": (
+        "01",
+        "0605F6B7C183FA81578BC39CFAD518132B9DF62897009AF7E522C32D6DC7BFFB",
+    ),
+    "GostR3410_2012_TC26_ParamSetC": (
+        "01",
+        "9E4F5D8C017D8D9F13A5CF3CDF5BFE4DAB402D54198E31EBDE28A0621050439CA6B39E0A515C06B304E2CE43E79E369E91A0CFC2BC2A22B4CA302DBB33EE7550",
+    ),
 }
 
 CURVE_PARAMS = {}
 for c, params in CURVE_PARAMS_TEXT.items():
     CURVE_PARAMS[c] = [hexdec(param) for param in params]
+for c, (e, d) in CURVE_EDWARDS_TEXT.items():
+    p, _, a, b = [bytes2long(param) for param in CURVE_PARAMS[c][:4]]
+    register_edwards(p, a, b, bytes2long(hexdec(e)), bytes2long(hexdec(d)))
+
+
+class PointTable(object):
+    """ Fixed point precomputation table
+
+    Point P is split into rows by `window` bits of scalar: row i holds
+    j * 2^(i * window) * P for j in 1..2^window - 1, rows are stored flat in
+    `points` sequence of (x, y) tuples.
+    """
+
+    def __init__(self, window, points):
+        self.window = window
+        self.points = points
+
+    @property
+    def rows(self):
+        return len(self.points) // ((1 << self.window) - 1)
+
+
+# Guards one-time build of tables cached on curves
+_tables_lock = Lock()
 
 
 class GOST3410Curve(object):
     def __iter__(self):
         for i in [self.p, self.q, self.a, self.b, self.x, self.y]:
-            yield i
+            yield int(i)
 
     def __init__(self, p, q, a, b, x, y):
         self.p = bytes2long(p)
@@ -74,30 +130,106 @@ class GOST3410Curve(object):
         self.b = bytes2long(b)
         self.x = bytes2long(x)
         self.y = bytes2long(y)
+        self.field = field_for(self.p)
+        self.reduce = self.field.reduce
+        self.edwards = edwards_for(self.p, self.a, self.b, self.reduce)
+        self._base_tables = {}
         r1 = self.y * self.y % self.p
         r2 = ((self.x * self.x + self.a) * self.x + self.b) % self.p
         if r2 < 0:
             r2 += self.p
         if r1 != r2:
             raise ValueError("Invalid parameters")
+        if self.edwards is not None:
+            self._edwards_base = self.edwards.from_weierstrass(self.x, self.y)
 
-    def _pos(self, v):
-        if v < 0:
-            return v + self.p
-        return v
+    def contains(self, x, y):
+        """ Check that point (x, y) lies on the curve
+        """
+        if not (0 <= x < self.p and 0 <= y < self.p):
+            return False
+        return self.reduce(y * y) == self.reduce((x * x + self.a) * x + self.b)
 
     def _add(self, p1x, p1y, p2x, p2y):
+        reduce = self.reduce
         if p1x == p2x and p1y == p2y:
-            t = ((3 * p1x * p1x + self.a) * modinvert(2 * p1y, self.p)) % self.p
+            t = reduce((3 * p1x * p1x + self.a) * modinvert(2 * p1y, self.p))
         else:
-            tx = self._pos(p2x - p1x) % self.p
-            ty = self._pos(p2y - p1y) % self.p
-            t = (ty * modinvert(tx, self.p)) % self.p
-        tx = self._pos(t * t - p1x - p2x) % self.p
-        ty = self._pos(t * (p1x - tx) - p1y) % self.p
+            tx = reduce(p2x - p1x)
+            ty = reduce(p2y - p1y)
+            t = reduce(ty * modinvert(tx, self.p))
+        tx = reduce(t * t - p1x - p2x)
+        ty = reduce(t * (p1x - tx) - p1y)
         return tx, ty
 
-    def exp(self, degree, x=None, y=None):
+    def precompute(self, x=None, y=None, window=4):
+        """ Build PointTable for fast multiplication of fixed point
+
+        :param window: scalar bits handled by single table lookup,
+            table holds ceil(bits(q) / window) * (2^window - 1) points
+        :rtype: PointTable
+        """
+        bx = x or self.x
+        by = y or self.y
+        if self.edwards is not None:
+            u, v = self.edwards.from_weierstrass(bx, by)
+            return PointTable(window, self.edwards.precompute(u, v, self.q.bit_length(), window))
+        points = []
+        for _ in range(0, self.q.bit_length(), window):
+            tx, ty = bx, by
+            points.append((tx, ty))
+            for _ in range((1 << window) - 2):
+                tx, ty = self._add(tx, ty, bx, by)
+                points.append((tx, ty))
+            # (2^window - 1) * base + base is the next row base
+            bx, by = self._add(tx, ty, bx, by)
+        return PointTable(window, points)
+
+    def base_table(self, window=4):
+        """ Base point PointTable, built once per curve object and window,
+        concurrent callers wait for the first build instead of repeating it
+        """
+        table = self._base_tables.get(window)
+        if table is None:
+            with _tables_lock:
+                table = self._base_tables.get(window)
+                if table is None:
+                    table = self._base_tables[window] = self.precompute(window=window)
+        return table
+
+    def exp_table(self, degree, table):
+        """ Multiply point precomputed in table by degree
+
+        Only additions are needed, one per non-zero window of degree.
+        Tables of curves with Edwards form hold Edwards (u, v) points.
+        """
+        degree %= self.q
+        if degree == 0:
+            raise ValueError("Bad degree value")
+        if self.edwards is not None:
+            return self.edwards.to_weierstrass(self.edwards.mul_table(degree, table))
+        window = table.window
+        mask = (1 << window) - 1
+        points = table.points
+        tx = ty = None
+        offset = 0
+        while degree != 0:
+            digit = degree & mask
+            if digit:
+                px, py = points[offset + digit - 1]
+                if tx is None:
+                    tx, ty = px, py
+                else:
+                    tx, ty = self._add(tx, ty, px, py)
+            degree >>= window
+            offset += mask
+        return tx, ty
+
+    def exp(self, degree, x=None, y=None, table=None):
+        if table is not None:
+            return self.exp_table(degree, table)
+        if self.edwards is not None:
+            return self._exp_edwards(degree, x, y)
         x = x or self.x
         y = y or self.y
         tx = x
@@ -112,17 +244,29 @@ class GOST3410Curve(object):
             x, y = self._add(x, y, x, y)
         return tx, ty
 
+    def _exp_edwards(self, degree, x=None, y=None):
+        # Same degree check as Weierstrass exp
+        if degree == 1:
+            raise ValueError("Bad degree value")
+        if x or y:
+            u, v = self.edwards.from_weierstrass(x or self.x, y or self.y)
+        else:
+            u, v = self._edwards_base
+        return self.edwards.to_weierstrass(self.edwards.mul(degree, u, v))
+
 
-def public_key(curve, prv):
-    return curve.exp(prv)
+def public_key(curve, prv, base_table=None):
+    x, y = curve.exp(prv, table=base_table)
+    return int(x), int(y)
 
 
-def sign(curve, prv, digest, mode=2012):
+def sign(curve, prv, digest, mode=2012, base_table=None):
     """
     :param GOST3410Curve curve: curve
     :param long prv: private key
     :param digest: digest for signing
     :type digest: bytes, 32 or 64 bytes
+    :param PointTable base_table: optional precomputed curve base point table
     :returns: signature
     :rtype: int tuple
     """
@@ -136,7 +280,7 @@ def sign(curve, prv, digest, mode=2012):
         k = bytes2long(urandom(size)) % q
         if k == 0:
             continue
-        r, _ = curve.exp(k)
+        r, _ = curve.exp(k, table=base_table)
         r %= q
         if r == 0:
             continue
@@ -147,10 +291,10 @@ def sign(curve, prv, digest, mode=2012):
             continue
         break
     # return long2bytes(s, size) + long2bytes(r, size)
-    return r, s
+    return int(r), int(s)
 
 
-def verify(curve, pub, digest, signature, mode=2012):
+def verify(curve, pub, digest, signature, mode=2012, base_table=None, pub_table=None):
     """
     :param GOST3410Curve curve: curve
     :type pub: (long, long)
@@ -158,6 +302,8 @@ def verify(curve, pub, digest, signature, mode=2012):
     :type digest: bytes, 32 or 64 bytes
     :param signature: r, s from signature
     :type signature: bytes, 64 or 128 bytes
+    :param PointTable base_table: optional precomputed curve base point table
+    :param PointTable pub_table: optional precomputed public key table
     :rtype: bool
     """
     r, s = signature
@@ -177,17 +323,17 @@ def verify(curve, pub, digest, signature, mode=2012):
     v = modinvert(e, q)
     z1 = s * v % q
     z2 = q - r * v % q
-    p1x, p1y = curve.exp(z1)
-    q1x, q1y = curve.exp(z2, pub[0], pub[1])
+    p1x, p1y = curve.exp(z1, table=base_table)
+    q1x, q1y = curve.exp(z2, pub[0], pub[1], table=pub_table)
     lm = q1x - p1x
     if lm < 0:
         lm += p
     lm = modinvert(lm, p)
     z1 = q1y - p1y
-    lm = lm * z1 % p
-    lm = lm * lm % p
+    lm = curve.reduce(lm * z1)
+    lm = curve.reduce(lm * lm)
     lm = lm - p1x - q1x
-    lm = lm % p
+    lm = curve.reduce(lm)
     if lm < 0:
         lm += p
     lm %= q
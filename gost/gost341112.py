@@ -180,6 +180,13 @@ def g(n, hsh, msg):
     return strxor(strxor(res, hsh), msg)
 
 
+def g_iv(digest_size, msg):
+    """ g(0, IV, msg) with precomputed key schedule of IV
+    """
+    res = E_scheduled(IV_KEYS[digest_size], msg)
+    return strxor(strxor(res, IV[digest_size]), msg)
+
+
 def E(k, msg):
     for i in range(12):
         msg = LPS(strxor(k, msg))
@@ -187,6 +194,24 @@ def E(k, msg):
     return strxor(k, msg)
 
 
+def E_scheduled(keys, msg):
+    """ E() with round keys computed by key_schedule()
+    """
+    for i in range(12):
+        msg = LPS(strxor(keys[i], msg))
+    return strxor(keys[12], msg)
+
+
+def key_schedule(k):
+    """ All 13 round keys of E() for initial key k
+    """
+    keys = [k]
+    for i in range(12):
+        k = LPS(strxor(k, C[i]))
+        keys.append(k)
+    return keys
+
+
 def LPS(data):
     return L(PS(bytearray(data)))
 
@@ -211,6 +236,15 @@ def L(data):
     return b''.join(res)
 
 
+IV = {
+    256: BLOCKSIZE * b"\x01",
+    512: BLOCKSIZE * b"\x00",
+}
+# First g() of every message starts from IV with n = 0, its key schedule
+# is the same for all messages of the same digest size
+IV_KEYS = dict((size, key_schedule(LPS(iv))) for size, iv in IV.items())
+
+
 class GOST341112(object):
     """ GOST 34.11-12 big-endian hash
     >>> m = GOST341112(digest_size=256)
@@ -227,36 +261,54 @@ class GOST341112(object):
         :type digest_size: 256 or 512
         """
         self.digest_size = digest_size
-        self.data = data
+        self.hsh = IV[digest_size]
+        self.chk = BLOCKSIZE * b'\x00'
+        self.n = 0
+        self.buf = b''
+        if data:
+            self.update(data)
+
+    def copy(self):
+        obj = self.__class__(digest_size=self.digest_size)
+        obj.hsh, obj.chk, obj.n, obj.buf = self.hsh, self.chk, self.n, self.buf
+        return obj
 
     def update(self, data):
         """ Append data that has to be hashed
-        """
-        self.data += data
 
-    def digest(self):
-        """ Get hash of the provided data
+        Full blocks are compressed immediately, so data can be fed by chunks
+        without keeping the whole message in memory.
         """
-        hsh = BLOCKSIZE * (b'\x01' if self.digest_size == 256 else b'\x00')
-        chk = BLOCKSIZE * b'\x00'
-        n = 0
-        data = self.data
-        for i in xrange(0, len(data) // BLOCKSIZE * BLOCKSIZE, BLOCKSIZE):
+        data = self.buf + bytes(data)
+        end = len(data) // BLOCKSIZE * BLOCKSIZE
+        hsh, chk, n = self.hsh, self.chk, self.n
+        for i in xrange(0, end, BLOCKSIZE):
             block = data[i:i + BLOCKSIZE]
-            hsh = g(n, hsh, block)
+            hsh = g_iv(self.digest_size, block) if n == 0 else g(n, hsh, block)
             chk = add512bit(chk, block)
             n += 512
+        self.hsh, self.chk, self.n = hsh, chk, n
+        self.buf = data[end:]
+
+    def digest(self):
+        """ Get hash of the provided data
+        """
+        hsh, chk, n = self.hsh, self.chk, self.n
 
         # Padding
-        padblock_size = len(data) * 8 - n
-        data += b'\x01'
-        padlen = BLOCKSIZE - len(data) % BLOCKSIZE
-        if padlen != BLOCKSIZE:
-            data += b'\x00' * padlen
+        padblock_size = len(self.buf) * 8
+        block = self.buf + b'\x01' + b'\x00' * (BLOCKSIZE - 1 - len(self.buf))
+
+        if n == 0:
+            # Message shorter than block: checksum is the padded block itself
+            hsh = g_iv(self.digest_size, block)
+            hsh = g(0, hsh, pack("<Q", padblock_size) + 56 * b'\x00')
+            hsh = g(0, hsh, block)
+            return hsh[32:] if self.digest_size == 256 else hsh
 
-        hsh = g(n, hsh, data[-BLOCKSIZE:])
+        hsh = g(n, hsh, block)
         n += padblock_size
-        chk = add512bit(chk, data[-BLOCKSIZE:])
+        chk = add512bit(chk, block)
         hsh = g(0, hsh, pack("<Q", n) + 56 * b'\x00')
         hsh = g(0, hsh, chk)
         if self.digest_size == 256:
@@ -0,0 +1,231 @@
+# coding: utf-8
+""" Flat binary precomputation tables shared between processes
+
+PointTable is serialized into fixed-width layout:
+
+    header  magic(8) | window u16 | coordinate size u16 | points count u32
+    points  x | y, each coordinate is big-endian, `size` bytes
+
+Tables are placed into multiprocessing.shared_memory segments or into
+files, readers map them and decode points on access, so memory does not
+grow with number of processes attached to the same table.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import threading
+from hashlib import md5
+
+from . import arith
+from .gost341012 import PointTable
+from .utils import long2bytes
+
+MAGIC = b"GSTPTBL1"
+SHM_DIR = "/dev/shm"
+_HEADER = struct.Struct(">8sHHI")
+
+
+class FlatPoints(object):
+    """ Read-only sequence of (x, y) points over flat table buffer
+    """
+
+    def __init__(self, buf, size, count, offset=_HEADER.size):
+        self._buf = memoryview(buf)
+        self._size = size
+        self._count = count
+        self._offset = offset
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= self._count:
+            raise IndexError("point index out of range")
+        size = self._size
+        start = self._offset + idx * 2 * size
+        from_bytes = arith.backend.from_bytes
+        return (
+            from_bytes(self._buf[start:start + size].tobytes()),
+            from_bytes(self._buf[start + size:start + 2 * size].tobytes()),
+        )
+
+    def release(self):
+        self._buf.release()
+
+
+def coordinate_size(curve):
+    return (int(curve.p).bit_length() + 7) // 8
+
+
+def table_size(table, size):
+    return _HEADER.size + len(table.points) * 2 * size
+
+
+def write_table(table, size, buf):
+    """ Serialize PointTable into writable buffer, magic is written last
+    so readers never see partially filled table as valid
+    """
+    offset = _HEADER.size
+    for x, y in table.points:
+        buf[offset:offset + 2 * size] = long2bytes(x, size) + long2bytes(y, size)
+        offset += 2 * size
+    _HEADER.pack_into(buf, 0, b"\x00" * len(MAGIC), table.window, size, len(table.points))
+    buf[:len(MAGIC)] = MAGIC
+
+
+def read_table(buf):
+    """ PointTable view over serialized table buffer
+
+    :raises ValueError: if buffer does not hold complete table
+    """
+    magic, window, size, count = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or len(buf) < _HEADER.size + count * 2 * size:
+        raise ValueError("Not a point table")
+    return PointTable(window, FlatPoints(buf, size, count))
+
+
+def is_table(path):
+    """ Whether file holds complete serialized table, checks header only
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            length = os.fstat(f.fileno()).st_size
+    except OSError:
+        return False
+    if len(header) < _HEADER.size:
+        return False
+    magic, window, size, count = _HEADER.unpack(header)
+    return magic == MAGIC and length >= _HEADER.size + count * 2 * size
+
+
+def table_name(curve, x=None, y=None, window=4):
+    """ Stable name of table for point (x, y) (curve base point by default)
+    """
+    ident = ",".join(str(int(v)) for v in tuple(curve) + (x or curve.x, y or curve.y, window))
+    if curve.edwards is not None:
+        # Table holds Edwards points
+        ident += ",edwards"
+    return "gost_" + md5(ident.encode("ascii")).hexdigest()[:20]
+
+
+def save_table(table, size, path):
+    """ Atomically write table into file
+    """
+    data = bytearray(table_size(table, size))
+    write_table(table, size, data)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_table(path):
+    """ Map table file read-only
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return read_table(mapped)
+
+
+def file_table(directory, curve, x=None, y=None, window=4):
+    """ Load table from directory, building and saving it on first use
+    """
+    path = os.path.join(directory, table_name(curve, x, y, window) + ".tbl")
+    try:
+        return load_table(path)
+    except (OSError, ValueError):
+        save_table(curve.precompute(x, y, window), coordinate_size(curve), path)
+        return load_table(path)
+
+
+class SharedTables(object):
+    """ Tables published into shared memory by this process
+
+    Publishing process owns segments and unlinks them in unlink_all(),
+    other processes attach() by name without copying. Segment of another
+    owner is reused while it holds complete table and is republished by
+    this process once it is gone or left half-written, so attach() of a
+    name may still fail when owner unlinks it meanwhile.
+    """
+
+    def __init__(self):
+        self.segments = {}
+
+    def publish(self, curve, x=None, y=None, window=4):
+        """ Build table (once) and place it into shared memory
+        :returns: segment name for attach()
+        """
+        from multiprocessing import shared_memory
+
+        name = table_name(curve, x, y, window)
+        if name in self.segments:
+            return name
+        shm_path = os.path.join(SHM_DIR, name)
+        if os.path.exists(shm_path):
+            if is_table(shm_path):
+                # Published by another process, it owns the segment
+                return name
+            # Left without magic by crashed publisher
+            try:
+                os.unlink(shm_path)
+            except FileNotFoundError:
+                pass
+        table = curve.precompute(x, y, window)
+        size = coordinate_size(curve)
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=table_size(table, size))
+        except FileExistsError:
+            # Being published by another process, it owns the segment
+            return name
+        write_table(table, size, segment.buf)
+        self.segments[name] = segment
+        return name
+
+    def unlink_all(self):
+        for segment in self.segments.values():
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                # Already removed by resource tracker of attached process
+                pass
+        self.segments = {}
+
+
+_attached = {}
+_attach_lock = threading.Lock()
+
+
+def attach(name):
+    """ Attach to published table, segment stays mapped for process lifetime
+
+    On Linux segment is mapped read-only from /dev/shm. Safe to call from
+    many threads, segment is mapped once.
+    """
+    table = _attached.get(name)
+    if table is not None:
+        return table
+    with _attach_lock:
+        table = _attached.get(name)
+        if table is None:
+            table = _attached[name] = _attach(name)
+    return table
+
+
+def _attach(name):
+    shm_path = os.path.join(SHM_DIR, name)
+    if os.path.exists(shm_path):
+        table = load_table(shm_path)
+    else:
+        from multiprocessing import shared_memory
+
+        if sys.version_info >= (3, 13):
+            segment = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            segment = shared_memory.SharedMemory(name=name)
+        table = read_table(segment.buf)
+        table.segment = segment
+    return table
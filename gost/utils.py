@@ -18,6 +18,8 @@ from codecs import getdecoder
 from codecs import getencoder
 from sys import version_info
 
+from . import arith
+
 
 xrange = range if version_info[0] == 3 else xrange  # pylint: disable=redefined-builtin
 
@@ -54,14 +56,13 @@ def hexenc(data):
 def bytes2long(raw):
     """ Deserialize big-endian bytes into long number
 
-    :param bytes raw: binary string
+    :param bytes raw: binary string, numbers are converted to backend type
     :returns: deserialized long number
-    :rtype: int
+    :rtype: int or backend number type
     """
-    if isinstance(raw, int):
-        return raw
-
-    return int(hexenc(raw), 16)
+    if isinstance(raw, (bytes, bytearray)):
+        return arith.backend.from_bytes(raw)
+    return arith.backend.mpz(raw)
 
 
 def long2bytes(n, size=32):
@@ -85,20 +86,6 @@ def modinvert(a, n):
 
     :returns: inverse number. -1 if it does not exist
 
-    Realization is taken from:
-    https://en.wikipedia.org/wiki/Extended_Euclidean_algorithm
+    Computed by active arithmetic backend (see gost.arith).
     """
-    if a < 0:
-        # k^-1 = p - (-k)^-1 mod p
-        return n - modinvert(-a, n)
-    t, newt = 0, 1
-    r, newr = n, a
-    while newr != 0:
-        quotinent = r // newr
-        t, newt = newt, t - quotinent * newt
-        r, newr = newr, r - quotinent * newr
-    if r > 1:
-        return -1
-    if t < 0:
-        t = t + n
-    return t
+    return arith.backend.invert(a, n)
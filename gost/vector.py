@@ -0,0 +1,351 @@
+# coding: utf-8
+""" Batch scalar multiplication on vectors of field elements
+
+K independent points are multiplied in lockstep. Field elements of all of
+them are kept in NumPy arrays of 24-bit limbs, shape (limbs, K): row i
+holds limb i of every element, so each field operation of the doubling
+and addition formulas is a few array operations over K elements instead
+of K interpreter round trips.
+
+Multiplication is schoolbook convolution of int64 limbs, carries are
+propagated in parallel (limbs stay slightly redundant), high limbs are
+folded back with precomputed 2^(24 * j) mod p rows as float64 matrix
+product, which is exact below 2^53. Points are in Jacobian coordinates,
+scalars are processed by 4-bit windows with per lane table of 15 points,
+lanes take their table entries with gather and skip zero digits with
+masks, so there are no per lane branches. Jacobian formulas are not
+complete: points must have order q and degrees must be non-zero modulo q,
+as for GOST3410Curve.exp().
+
+NumPy is optional: without it (and by default for small batches or with
+gmpy2 backend, see use_vector()) batch_exp() and batch_verify() call
+GOST3410Curve.exp() and verify() for every item.
+"""
+
+from . import arith
+from .gost341012 import verify
+from .utils import bytes2long
+from .utils import modinvert
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+LIMB_BITS = 24
+LIMB_BYTES = LIMB_BITS // 8
+LIMB_MASK = (1 << LIMB_BITS) - 1
+# Spare bits above p: unreduced values of lazy additions fit into limbs
+LIMB_SLACK = 32
+WINDOW = 4
+# Batch sizes (scalar multiplications) from which vector path beats scalar
+# code of Python integer backend, see python -m gost.vector. gmpy2 scalar
+# code is faster for all measured sizes.
+VECTOR_MIN_BATCH = 16
+VECTOR_MIN_BATCH_EDWARDS = 256
+
+
+class LimbField(object):
+    """ Prime field over (limbs, K) int64 arrays of K elements
+
+    mul() result is congruent to the product modulo p, its limbs are in
+    [0, 2^24] except the top one, which may be negative. Sums and
+    differences of a few elements are computed with array operators and
+    must go through norm() before mul().
+    """
+
+    def __init__(self, p):
+        self.p = int(p)
+        self.limbs = (self.p.bit_length() + LIMB_SLACK + LIMB_BITS - 1) // LIMB_BITS
+        limbs = self.limbs
+        # fold[i, j] is limb i of 2^(24 * (limbs + j)) mod p
+        self.fold = numpy.array([
+            [((1 << (LIMB_BITS * (limbs + j))) % self.p >> (LIMB_BITS * i)) & LIMB_MASK for j in range(limbs + 1)]
+            for i in range(limbs)
+        ], dtype=numpy.float64)
+
+    def encode(self, values):
+        """ Integers to (limbs, len(values)) array
+        """
+        size = self.limbs * LIMB_BYTES
+        raw = b"".join((int(v) % self.p).to_bytes(size, "little") for v in values)
+        parts = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(len(values), self.limbs, LIMB_BYTES)
+        parts = parts.astype(numpy.int64)
+        return (parts[:, :, 0] | (parts[:, :, 1] << 8) | (parts[:, :, 2] << 16)).T.copy()
+
+    def decode(self, a):
+        """ Array to list of integers modulo p
+        """
+        result = []
+        for column in a.T.tolist():
+            value = 0
+            for limb in reversed(column):
+                value = (value << LIMB_BITS) + limb
+            result.append(value % self.p)
+        return result
+
+    def constant(self, value, count):
+        return numpy.repeat(self.encode([value]), count, axis=1)
+
+    @staticmethod
+    def _carry(r, passes):
+        # Parallel carry, the top limb keeps its excess
+        for _ in range(passes):
+            carry = r[:-1] >> LIMB_BITS
+            r[:-1] &= LIMB_MASK
+            r[1:] += carry
+        return r
+
+    def norm(self, a):
+        """ Bring limbs of lazy sum back into mul() input range
+        """
+        return self._carry(a, 2)
+
+    def mul(self, a, b):
+        limbs = self.limbs
+        c = numpy.zeros((2 * limbs + 1, a.shape[1]), dtype=numpy.int64)
+        for i in range(limbs):
+            c[i:i + limbs] += a[i] * b
+        # Limbs were below 2^58, now at most 2^24 + 2^10, so the fold
+        # sums stay below 2^53
+        self._carry(c, 2)
+        r = c[:limbs] + numpy.dot(self.fold, c[limbs:].astype(numpy.float64)).astype(numpy.int64)
+        return self._carry(r, 2)
+
+    def sqr(self, a):
+        return self.mul(a, a)
+
+
+class JacobianBatch(object):
+    """ Lockstep Jacobian point arithmetic of curve y^2 = x^3 + ax + b
+    """
+
+    def __init__(self, curve, count):
+        self.curve = curve
+        self.count = count
+        self.field = LimbField(curve.p)
+        self.a = self.field.constant(curve.a, count)
+        self.a_minus_3 = (int(curve.a) + 3) % self.field.p == 0
+
+    def double(self, point):
+        f = self.field
+        X1, Y1, Z1 = point
+        if self.a_minus_3:
+            delta = f.sqr(Z1)
+            gamma = f.sqr(Y1)
+            beta = f.mul(X1, gamma)
+            alpha = f.norm(3 * f.mul(f.norm(X1 - delta), f.norm(X1 + delta)))
+            X3 = f.norm(f.sqr(alpha) - 8 * beta)
+            Z3 = f.norm(f.sqr(f.norm(Y1 + Z1)) - gamma - delta)
+            Y3 = f.norm(f.mul(alpha, f.norm(4 * beta - X3)) - 8 * f.sqr(gamma))
+            return X3, Y3, Z3
+        XX = f.sqr(X1)
+        YY = f.sqr(Y1)
+        YYYY = f.sqr(YY)
+        ZZ = f.sqr(Z1)
+        S = f.norm(2 * (f.sqr(f.norm(X1 + YY)) - XX - YYYY))
+        M = f.norm(3 * XX + f.mul(self.a, f.sqr(ZZ)))
+        T = f.norm(f.sqr(M) - 2 * S)
+        Y3 = f.norm(f.mul(M, f.norm(S - T)) - 8 * YYYY)
+        Z3 = f.norm(f.sqr(f.norm(Y1 + Z1)) - YY - ZZ)
+        return T, Y3, Z3
+
+    def add(self, p1, p2):
+        """ p1 + p2 for p1 != +-p2, p2 must not be infinity
+        """
+        f = self.field
+        X1, Y1, Z1 = p1
+        X2, Y2, Z2 = p2
+        Z1Z1 = f.sqr(Z1)
+        Z2Z2 = f.sqr(Z2)
+        U1 = f.mul(X1, Z2Z2)
+        U2 = f.mul(X2, Z1Z1)
+        S1 = f.mul(Y1, f.mul(Z2, Z2Z2))
+        S2 = f.mul(Y2, f.mul(Z1, Z1Z1))
+        H = f.norm(U2 - U1)
+        I = f.sqr(f.norm(2 * H))
+        J = f.mul(H, I)
+        r = f.norm(2 * (S2 - S1))
+        V = f.mul(U1, I)
+        X3 = f.norm(f.sqr(r) - J - 2 * V)
+        Y3 = f.norm(f.mul(r, f.norm(V - X3)) - 2 * f.mul(S1, J))
+        Z3 = f.mul(f.norm(f.sqr(f.norm(Z1 + Z2)) - Z1Z1 - Z2Z2), H)
+        return X3, Y3, Z3
+
+    def table(self, xs, ys):
+        """ Per lane 1..15 multiples of affine points, arrays of shape (16, limbs, K)
+        """
+        f = self.field
+        base = (f.encode(xs), f.encode(ys), f.constant(1, self.count))
+        points = [base, self.double(base)]
+        while len(points) < (1 << WINDOW) - 1:
+            points.append(self.add(points[-1], base))
+        # Row 0 is never selected, zero digits are masked
+        points.insert(0, base)
+        return tuple(numpy.stack([point[i] for point in points]) for i in range(3))
+
+    def mul(self, degrees, xs, ys):
+        """ Jacobian degrees[i] * (xs[i], ys[i]), degrees in [1, q)
+        """
+        f = self.field
+        count = self.count
+        table = self.table(xs, ys)
+        size = (int(self.curve.q).bit_length() + 7) // 8
+        raw = b"".join(int(d).to_bytes(size, "big") for d in degrees)
+        octets = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(count, size)
+        # Most significant window first, shape (windows, K)
+        digits = numpy.stack([octets >> 4, octets & 15], axis=2).reshape(count, 2 * size).T.astype(numpy.intp)
+        acc = None
+        infinity = numpy.ones(count, dtype=bool)
+        for row in digits:
+            if acc is not None:
+                for _ in range(WINDOW):
+                    acc = self.double(acc)
+            index = numpy.broadcast_to(row, (1, f.limbs, count))
+            entry = tuple(numpy.take_along_axis(coord, index, axis=0)[0] for coord in table)
+            if acc is None:
+                acc = entry
+            else:
+                added = self.add(acc, entry)
+                acc = tuple(
+                    numpy.where(infinity, e, numpy.where(row != 0, s, a))
+                    for e, s, a in zip(entry, added, acc)
+                )
+            infinity &= row == 0
+        return acc
+
+    def to_affine(self, point):
+        """ Affine (x, y) tuples, None for points at infinity
+        """
+        p = self.field.p
+        result = []
+        for x, y, z in zip(*(self.field.decode(coord) for coord in point)):
+            if z == 0:
+                result.append(None)
+                continue
+            z_inv = modinvert(z, p)
+            zz_inv = z_inv * z_inv % p
+            result.append((x * zz_inv % p, y * zz_inv * z_inv % p))
+        return result
+
+
+def use_vector(curve, count):
+    """ Whether count scalar multiplications are faster on vector path
+    """
+    if numpy is None or arith.backend.name != arith.PythonBackend.name:
+        return False
+    return count >= (VECTOR_MIN_BATCH_EDWARDS if curve.edwards is not None else VECTOR_MIN_BATCH)
+
+
+def batch_exp(curve, degrees, points=None, vector=None):
+    """ Multiply many points at once
+
+    :param GOST3410Curve curve: curve
+    :param degrees: scalars
+    :param points: (x, y) points of order q, curve base point for all by default
+    :param vector: force (True) or disable (False) NumPy path,
+        chosen by use_vector() by default
+    :returns: list of (x, y) degrees[i] * points[i]
+    :raises ValueError: if some degree is 0 modulo q
+    """
+    degrees = [int(d) % int(curve.q) for d in degrees]
+    if points is None:
+        points = [(curve.x, curve.y)] * len(degrees)
+    if len(points) != len(degrees):
+        raise ValueError("Degrees and points count mismatch")
+    if 0 in degrees:
+        raise ValueError("Bad degree value")
+    if vector is None:
+        vector = use_vector(curve, len(degrees))
+    if not vector:
+        return [
+            tuple(int(c) for c in curve.exp(d, x, y)) for d, (x, y) in zip(degrees, points)
+        ]
+    if numpy is None:
+        raise ImportError("NumPy is required for vector path")
+    engine = JacobianBatch(curve, len(degrees))
+    result = engine.to_affine(engine.mul(degrees, [x for x, _ in points], [y for _, y in points]))
+    if None in result:
+        raise ValueError("Point is not of order q")
+    return result
+
+
+def batch_verify(curve, items, vector=None):
+    """ Verify many signatures at once
+
+    :param GOST3410Curve curve: curve
+    :param items: (pub, digest, (r, s)) tuples, see gost341012.verify()
+    :param vector: see batch_exp()
+    :returns: list of bool
+    """
+    items = list(items)
+    if vector is None:
+        vector = use_vector(curve, 2 * len(items))
+    if not vector:
+        return [verify(curve, pub, digest, signature) for pub, digest, signature in items]
+    q = int(curve.q)
+    p = int(curve.p)
+    result = [False] * len(items)
+    checked = []
+    degrees = []
+    points = []
+    for i, (pub, digest, (r, s)) in enumerate(items):
+        if r <= 0 or r >= q or s <= 0 or s >= q:
+            continue
+        e = bytes2long(digest) % q
+        if e == 0:
+            e = 1
+        v = modinvert(e, q)
+        checked.append(i)
+        degrees.extend((s * v % q, q - r * v % q))
+        points.extend(((int(curve.x), int(curve.y)), (int(pub[0]), int(pub[1]))))
+    if not checked:
+        return result
+    engine = JacobianBatch(curve, len(degrees))
+    products = engine.to_affine(engine.mul(degrees, [x for x, _ in points], [y for _, y in points]))
+    for n, i in enumerate(checked):
+        p1, q1 = products[2 * n], products[2 * n + 1]
+        if p1 is None or q1 is None or p1[0] == q1[0]:
+            # Negligible for valid signatures, scalar verify() does not handle it either
+            continue
+        lm = (q1[1] - p1[1]) * modinvert((q1[0] - p1[0]) % p, p) % p
+        result[i] = (lm * lm - p1[0] - q1[0]) % p % q == items[i][2][0]
+    return result
+
+
+if __name__ == "__main__":
+    # Batch size where vector path beats scalar code: python -m gost.vector
+    import sys
+    from os import urandom
+    from time import perf_counter
+
+    from . import arith
+    from . import gost341012
+    from . import vector
+
+    if vector.numpy is None:
+        sys.exit("NumPy is not installed")
+    sizes = [int(v) for v in sys.argv[1:]] or [1, 8, 32, 128, 512]
+    prv = gost341012.prv_unmarshal(bytes(range(1, 65)))
+    for name in arith.BACKENDS:
+        try:
+            arith.set_backend(name)
+        except ImportError:
+            continue
+        for curve_name in ("GostR3410_2012_TC26_256_ParamSetA", "GostR3410_2012_TC26_ParamSetA"):
+            curve = gost341012.GOST3410Curve(*gost341012.CURVE_PARAMS[curve_name])
+            pub = gost341012.public_key(curve, prv)
+            for size in sizes:
+                items = []
+                for _ in range(size):
+                    digest = urandom(64)
+                    items.append((pub, digest, gost341012.sign(curve, prv, digest)))
+                timings = []
+                for use in (False, True):
+                    started = perf_counter()
+                    assert all(vector.batch_verify(curve, items, vector=use))
+                    timings.append((perf_counter() - started) * 1000 / size)
+                print("%-7s %-33s batch %4d: scalar %6.1f ms, vector %6.1f ms per verification" % (
+                    name, curve_name, size, timings[0], timings[1],
+                ))
@@ -0,0 +1,290 @@
+"""
+Background sign/verify jobs running in a persistent process pool.
+
+Worker processes keep Signer/Verifier contexts between jobs. Point tables are built once by the
+submitting process and published into shared memory, workers attach to them without copying. Workers report hashing progress
+through a manager dict, which is also used to request cancellation of running jobs.
+Signatures are returned to the submitting process, which is the only writer of .sign files and bundles.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from os.path import basename
+
+
+from bundle import SignatureBundle
+from core import Signer, Verifier, check_cosigners, check_filesize, hash_file, read_signature, verify_signers
+from gost import tables
+from gost.gost341012 import GOST3410Curve
+
+JOB_CHUNK_SIZE = 1 << 16
+MAX_CONTEXTS = 8
+# Seconds state waits for a finished sign job to store its signature before reporting it as writing
+WRITE_WAIT = 1.0
+
+_progress = None
+_cancelled = None
+_contexts = OrderedDict()
+
+
+class JobCancelled(Exception):
+    """Raised in worker when running job is cancelled."""
+
+
+def _init_worker(progress, cancelled):
+    global _progress, _cancelled
+    _progress = progress
+    _cancelled = cancelled
+    # Keep shell prompt clean, results are reported by the shell itself
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _attach(name):
+    try:
+        return tables.attach(name)
+    except (OSError, ValueError):
+        # Segment unlinked by its owner or incomplete, context builds own table
+        return None
+
+
+def _context(cls, curve_params, key, **table_names):
+    ctx_key = (cls.__name__, tuple(curve_params), key)
+    ctx = _contexts.get(ctx_key)
+    if ctx is None:
+        shared = dict((arg, _attach(name)) for arg, name in table_names.items())
+        ctx = cls(GOST3410Curve(*curve_params), key, **shared)
+        _contexts[ctx_key] = ctx
+        if len(_contexts) > MAX_CONTEXTS:
+            _contexts.popitem(last=False)
+    else:
+        _contexts.move_to_end(ctx_key)
+    return ctx
+
+
+def _hash(job_id, path):
+    started = time.time()
+    _progress[job_id] = (0, started, None)
+
+    def progress(done):
+        if job_id in _cancelled:
+            raise JobCancelled('Job {0} cancelled'.format(job_id))
+        _progress[job_id] = (done, started, None)
+
+    dgst, filesize = hash_file(path, progress=progress, chunk_size=JOB_CHUNK_SIZE)
+    _progress[job_id] = (filesize, started, time.time())
+    return dgst, filesize
+
+
+def _sign_job(job_id, path, curve_params, prv, base_table):
+    signer = _context(Signer, curve_params, prv, base_table=base_table)
+    dgst, filesize = _hash(job_id, path)
+    return signer.encode(signer.create_signature(dgst, filename=basename(path), filesize=filesize))
+
+
+def _verify_job(job_id, path, curve_params, pub, sign_path, bundle_path, base_table, pub_table):
+    if bundle_path:
+        with SignatureBundle(bundle_path) as bundle:
+            struct = read_signature(path, bundle=bundle)
+        if struct is None:
+            raise ValueError('Cant find {0} in bundle {1}'.format(path, bundle_path))
+    else:
+        struct = read_signature(path, sign_path or path + '.sign')
+    verifier = _context(Verifier, curve_params, pub, base_table=base_table, pub_table=pub_table)
+    checked = verifier.check_signature(struct)
+    cosigners = check_cosigners(struct)
+    check_filesize(struct, path)
+    dgst, _ = _hash(job_id, path)
+    return verify_signers(checked, cosigners, dgst, verifier._verify_checked, verifier.cache)[0]
+
+
+class Job(object):
+    def __init__(self, job_id, kind, path, size, future, queue):
+        self.id = job_id
+        self.kind = kind
+        self.path = path
+        self.size = size
+        self.future = future
+        self.write_error = None
+        self.reported = False
+        self._queue = queue
+        # Set once result is stored: signature write attempt ended, verify jobs have nothing to write
+        self.written = threading.Event()
+        if kind != 'sign':
+            self.written.set()
+
+    def done(self, timeout=None):
+        """
+        Whether job finished and its signature write attempt (if any) ended, waits up to timeout for the write
+        """
+        return self.future.done() and self.written.wait(timeout)
+
+    @property
+    def progress(self):
+        """
+        (bytes hashed, started at, finished at) or None if job is not started
+        """
+        return self._queue.progress.get(self.id)
+
+    @property
+    def state(self):
+        if self.future.cancelled():
+            return 'cancelled'
+        if not self.future.done():
+            return 'running' if self.progress else 'pending'
+        if not self.written.wait(WRITE_WAIT):
+            return 'writing'
+        error = self.future.exception()
+        if isinstance(error, JobCancelled):
+            return 'cancelled'
+        if error is not None or self.write_error is not None:
+            return 'failed'
+        return 'done'
+
+    @property
+    def throughput(self):
+        """
+        Hashing speed, bytes per second
+        """
+        progress = self.progress
+        if not progress:
+            return 0
+        done, started, finished = progress
+        elapsed = (finished or time.time()) - started
+        return done / elapsed if elapsed > 0 else 0
+
+    def describe(self):
+        state = self.state
+        line = '[{0}] {1:<9} {2} {3}'.format(self.id, state, self.kind, self.path)
+        progress = self.progress
+        if progress:
+            line += ' {0}/{1} bytes, {2:.1f} KB/s'.format(progress[0], self.size, self.throughput / 1024)
+        if state == 'failed':
+            line += ': {0}'.format(self.future.exception() or self.write_error)
+        elif state == 'done' and self.kind == 'verify':
+            line += ': signature checking {0}'.format('successful' if self.future.result() else 'FAILED')
+        return line
+
+
+class JobQueue(object):
+    """
+    Persistent warm process pool for background sign / verify jobs
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.jobs = OrderedDict()
+        self.progress = None
+        self._cancelled = None
+        self._manager = None
+        self._pool = None
+        self._next_id = 1
+        self._write_lock = threading.Lock()
+        self.tables = tables.SharedTables()
+
+    def _executor(self):
+        if self._pool is None:
+            self._manager = Manager()
+            self.progress = self._manager.dict()
+            self._cancelled = self._manager.dict()
+            self._pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(self.progress, self._cancelled)
+            )
+        return self._pool
+
+    def _add(self, kind, path, size, future):
+        job = Job(self._next_id, kind, path, size, future, self)
+        self.jobs[job.id] = job
+        self._next_id += 1
+        return job
+
+    def submit_sign(self, path, curve, prv, bundle_path=None):
+        """
+        Sign file in background, signature is written to [path].sign or bundle when job finishes
+        """
+        size = os.path.getsize(path)
+        future = self._executor().submit(_sign_job, self._next_id, path, tuple(curve), prv, self.tables.publish(curve))
+        job = self._add('sign', path, size, future)
+        future.add_done_callback(lambda f: self._write_signature(job, bundle_path))
+        return job
+
+    def submit_verify(self, path, curve, pub, sign_path=None, bundle_path=None):
+        size = os.path.getsize(path)
+        future = self._executor().submit(
+            _verify_job, self._next_id, path, tuple(curve), tuple(pub), sign_path, bundle_path,
+            self.tables.publish(curve), self.tables.publish(curve, pub[0], pub[1])
+        )
+        return self._add('verify', path, size, future)
+
+    def _write_signature(self, job, bundle_path):
+        try:
+            self._store_signature(job, bundle_path)
+        finally:
+            job.written.set()
+
+    def _store_signature(self, job, bundle_path):
+        future = job.future
+        if future.cancelled() or future.exception() is not None:
+            return
+        try:
+            with self._write_lock:
+                if bundle_path:
+                    with SignatureBundle(bundle_path) as bundle:
+                        bundle.add(bundle.name_for(job.path), future.result())
+                else:
+                    with open(job.path + '.sign', 'wb') as sign_f:
+                        sign_f.write(future.result())
+        except Exception as e:
+            job.write_error = e
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel pending job or ask worker to stop running one, returns False if job already finished
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.future.done():
+            return False
+        if not job.future.cancel():
+            self._cancelled[job_id] = True
+        return True
+
+    def wait(self, job_id=None, timeout=None):
+        """
+        Wait for job (or all jobs) to finish and its signature to be written
+        """
+        jobs = [self.jobs[job_id]] if job_id is not None else list(self.jobs.values())
+        deadline = time.time() + timeout if timeout is not None else None
+        for job in jobs:
+            try:
+                job.future.exception(timeout=None if deadline is None else max(deadline - time.time(), 0))
+            except Exception:
+                # Cancelled or timed out, state tells which one
+                pass
+            if job.future.done():
+                job.written.wait(None if deadline is None else max(deadline - time.time(), 0))
+        return jobs
+
+    def finished(self):
+        """
+        Jobs finished since previous call, sign jobs are reported once their signature write attempt ended
+        """
+        done = [job for job in self.jobs.values() if not job.reported and job.done(0)]
+        for job in done:
+            job.reported = True
+        return done
+
+    def shutdown(self):
+        if self._pool is not None:
+            for job_id in self.jobs:
+                self.cancel(job_id)
+            self._pool.shutdown(wait=True)
+            self._manager.shutdown()
+            self.tables.unlink_all()
+            self._pool = None
+            self._manager = None
@@ -0,0 +1,87 @@
+"""
+Pipelined file ingestion: reader thread fills bounded queue of preallocated buffers
+while consumer (hasher) processes previous ones, so disk and CPU work overlap.
+"""
+import threading
+from queue import Queue
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_DEPTH = 4
+
+
+class ReadAhead(object):
+    """
+    Read file in background thread into `depth` preallocated buffers of `chunk_size` bytes.
+    Reading starts on construction, iterate to get memoryview chunks in file order.
+    Chunk is valid only until next chunk is requested, its buffer is reused for read-ahead then.
+    """
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE, depth=DEFAULT_DEPTH):
+        self.path = path
+        self.size = 0
+        self._file = open(path, 'rb')
+        self._free = Queue()
+        self._filled = Queue()
+        self._stop = threading.Event()
+        for _ in range(depth):
+            self._free.put(bytearray(chunk_size))
+        self._thread = threading.Thread(target=self._read, name='read-ahead', daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        try:
+            while not self._stop.is_set():
+                buf = self._free.get()
+                if buf is None:
+                    break
+                n = self._file.readinto(buf)
+                self._filled.put((buf, n))
+                if not n:
+                    break
+        except Exception as e:
+            self._filled.put((None, e))
+        finally:
+            self._file.close()
+
+    def __iter__(self):
+        try:
+            while True:
+                buf, n = self._filled.get()
+                if buf is None:
+                    raise n
+                if not n:
+                    break
+                self.size += n
+                yield memoryview(buf)[:n]
+                self._free.put(buf)
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+        # Wake reader if it waits for free buffer
+        self._free.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def hash_chunks(chunks, hasher, progress=None):
+    """
+    Feed chunks to hasher
+    :param chunks: iterable of bytes-like objects
+    :param hasher: object with update() and digest() methods
+    :param progress: optional callable receiving total bytes hashed after every chunk
+    :return: digest
+    """
+    done = 0
+    for chunk in chunks:
+        hasher.update(chunk)
+        if progress is not None:
+            done += len(chunk)
+            progress(done)
+    return hasher.digest()
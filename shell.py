@@ -1,11 +1,18 @@
 #!/usr/bin/python
 
+from binascii import hexlify, unhexlify, Error as HexError
 from cmd import Cmd
 import os
+from tarfile import TarError
 
 from gost.gost341012 import CURVE_PARAMS, CURVE_PARAMS_TEXT, GOST3410Curve, prv_unmarshal, public_key
-from core import verify_file, VerificationError
-from core import sign_file, SigningError
+from core import verify_file, verify_files, verify_digest, VerificationError, RejectedError
+from core import sign_file, sign_digest, cosign_file, hash_file, SigningError, Signer
+from bundle import SignatureBundle, BundleError
+from jobs import JobQueue
+from cache import VerificationCache
+from watch import Watch
+from archive import verify_archive
 from strutils import truncate
 
 curve_params_sequence = ['p', 'q', 'a', 'b', 'x', 'y']
@@ -74,6 +81,30 @@ class Shell(Cmd):
         self.keys = []
         self.history = []
         self.key = {}
+        self.bundle = None
+        self.jobs = JobQueue()
+        self.cache = None
+
+    def postcmd(self, stop, line):
+        for job in self.jobs.finished():
+            print(job.describe())
+        return stop
+
+    @staticmethod
+    def _background(arg):
+        arg = arg.strip()
+        if arg.endswith('&'):
+            return arg[:-1].strip(), True
+        return arg, False
+
+    def _open_bundle(self):
+        if not self.bundle:
+            return None
+        try:
+            return SignatureBundle(self.bundle)
+        except (BundleError, OSError) as e:
+            print('\nCant open bundle {0}: {1}\n'.format(self.bundle, e))
+            return False
 
     def do_genkeys(self, arg):
         """
@@ -182,59 +213,396 @@ class Shell(Cmd):
             print('\n')
             cntr += 1
 
+    def do_bundle(self, arg):
+        """
+        Store signatures in bundle file instead of .sign files: bundle [bundlepath] (bundle off - use .sign files)
+        """
+        path = arg.strip().replace("'", '')
+        if not path:
+            if self.bundle:
+                print('Using bundle {0}'.format(self.bundle))
+            else:
+                print('No bundle selected, using .sign files')
+            return
+        if path == 'off':
+            self.bundle = None
+            return
+        self.bundle = path
+        bundle = self._open_bundle()
+        if bundle is False:
+            self.bundle = None
+            return
+        with bundle:
+            print('Using bundle {0} ({1} signatures)'.format(self.bundle, len(bundle)))
+
+    def do_cache(self, arg):
+        """
+        Cache successful verifications: cache on [sqlite path], cache off, cache - show hit/miss stats
+        """
+        args = arg.split()
+        if not args:
+            if self.cache is None:
+                print('Verification cache is off')
+            else:
+                print('Verification cache: {hits} hits, {misses} misses, {size} entries'.format(**self.cache.stats()))
+        elif args[0] == 'on' and len(args) <= 2:
+            if self.cache is not None:
+                self.cache.close()
+            self.cache = VerificationCache(path=args[1] if len(args) == 2 else None)
+        elif args[0] == 'off' and len(args) == 1:
+            if self.cache is not None:
+                self.cache.close()
+            self.cache = None
+        else:
+            print('Wrong params!')
+
     def do_exit(self, arg):
         """
         Exit from app: exit
         """
+        self.jobs.shutdown()
         return True
 
+    @_privkey_warning
+    def do_watch(self, arg):
+        """
+        Keep signatures of directory up to date until Ctrl-C (signatures go to .sign files or selected bundle):
+        watch [dirpath] [workers]
+        """
+        args = [i.replace("'", '') for i in arg.split(' ') if i]
+        if not args or len(args) > 2:
+            print('Wrong params!')
+            return
+        workers = assert_int(args[1]) if len(args) == 2 else 2
+        if not workers or not os.path.isdir(args[0]):
+            print('Wrong params!')
+            return
+        bundle = self._open_bundle()
+        if bundle is False:
+            return
+        watch = Watch(args[0], Signer(self.key['curve'], self.key['priv']), bundle=bundle, workers=workers)
+        print('Watching {0} ({1}), Ctrl-C to stop'.format(args[0], watch.watcher.__class__.__name__))
+        print('{0} files to sign'.format(watch.reconcile()))
+        try:
+            while True:
+                for path, action in watch.step():
+                    print('{0}: {1}'.format(path, action))
+        except KeyboardInterrupt:
+            print('Stopping...')
+        finally:
+            watch.close()
+            if bundle is not None:
+                bundle.close()
+
+    def do_jobs(self, arg):
+        """
+        List background jobs with progress: jobs
+        """
+        if not self.jobs.jobs:
+            print('No jobs')
+        for job in self.jobs.jobs.values():
+            print(job.describe())
+
+    def do_wait(self, arg):
+        """
+        Wait for background job (or all jobs) to finish: wait [job id]
+        """
+        job_id = None
+        if arg.strip():
+            job_id = assert_int(arg)
+            if job_id is None or self.jobs.get(job_id) is None:
+                print('No such job!')
+                return
+        try:
+            self.jobs.wait(job_id)
+        except KeyboardInterrupt:
+            print('\nStopped waiting')
+
+    def do_cancel(self, arg):
+        """
+        Cancel background job: cancel [job id]
+        """
+        job_id = assert_int(arg)
+        if job_id is None:
+            return
+        if self.jobs.cancel(job_id):
+            print('Job {0} cancelled'.format(job_id))
+        else:
+            print('No such running job!')
+
     # I\O operations
     @_privkey_warning
     def do_sign(self, arg):
         """
-        Create signature (keypair must be selected): sign [filepath] (will create [filepath].sign file in folder)
+        Create signature (keypair must be selected): sign [filepath] (will create [filepath].sign file in folder,
+        or add signature to selected bundle), sign [filepath] & - run in background
         """
+        arg, background = self._background(arg)
         path = arg.replace("'", '')
+        if background:
+            try:
+                job = self.jobs.submit_sign(path, self.key['curve'], self.key['priv'], bundle_path=self.bundle)
+            except OSError as e:
+                print('\nError creating signature\n')
+                print(e)
+            else:
+                print('[{0}] sign {1}'.format(job.id, path))
+            return
+
+        bundle = self._open_bundle()
+        if bundle is False:
+            return
         try:
-            sign_file(path, self.key['curve'], self.key['priv'])
+            result = sign_file(path, self.key['curve'], self.key['priv'], bundle=bundle)
         except SigningError as e:
             print('\nError creating signature\n')
             print(e)
         else:
+            print(result.render())
             print('\nSignature created!\n')
+        finally:
+            if bundle is not None:
+                bundle.close()
+
+    def do_cosign(self, arg):
+        """
+        Sign file by several keypairs, file is hashed once and all signatures go to one [filepath].sign file
+        (or selected bundle), the first keypair is primary: cosign [filepath] [keys idx] [keys idx] ...
+        """
+        args = [i.replace("'", '') for i in arg.split(' ') if i]
+        if len(args) < 3:
+            print('Wrong params!')
+            return
+        indexes = [assert_int(i) for i in args[1:]]
+        if not all(indexes) or any(i > len(self.keys) for i in indexes):
+            print('Wrong index!')
+            return
+        keys = [self.keys[i - 1] for i in indexes]
+        if not all('priv' in key for key in keys):
+            print('There is no private key in the pair!')
+            return
+
+        bundle = self._open_bundle()
+        if bundle is False:
+            return
+        try:
+            result = cosign_file(args[0], [Signer(key['curve'], key['priv']) for key in keys], bundle=bundle)
+        except SigningError as e:
+            print('\nError creating signature\n')
+            print(e)
+        else:
+            print(result.render())
+            print('\nSignature created by {0} keys!\n'.format(len(keys)))
+        finally:
+            if bundle is not None:
+                bundle.close()
 
     @_pubkey_warning
     def do_verify(self, arg):
         """
         Check signature by open key (keypair must be selected): verify [filepath] [signpath]
+        (signature is taken from selected bundle if signpath is omitted), verify [filepath] [signpath] & - run in background
         """
+        arg, background = self._background(arg)
         paths = arg.split(' ')
         paths = [i.replace("'", '') for i in paths]
 
+        if background:
+            if len(paths) > 2:
+                print('Wrong params!')
+                return
+            sign_path = paths[1] if len(paths) == 2 else None
+            try:
+                job = self.jobs.submit_verify(
+                    paths[0], self.key['curve'], self.key['pub'], sign_path=sign_path,
+                    bundle_path=self.bundle if sign_path is None else None
+                )
+            except OSError as e:
+                print('\nError checking signature!\n')
+                print(e)
+            else:
+                print('[{0}] verify {1}'.format(job.id, paths[0]))
+            return
+
         if self.key:
             own_key = self.key['pub']
         else:
             own_key = None
 
         try:
-            if len(paths) == 2:
-                verification = verify_file(paths[0], sign_path=paths[1], own_pubkey=own_key)
+            if self.bundle and len(paths) == 1:
+                bundle = self._open_bundle()
+                if bundle is False:
+                    return
+                with bundle:
+                    verification = verify_file(paths[0], own_pubkey=own_key, bundle=bundle, cache=self.cache)
+            elif len(paths) == 2:
+                verification = verify_file(paths[0], sign_path=paths[1], own_pubkey=own_key, cache=self.cache)
             elif len(paths) == 1:
-                verification = verify_file(paths[0], own_pubkey=own_key)
+                verification = verify_file(paths[0], own_pubkey=own_key, cache=self.cache)
             else:
                 print('Wrong params!')
                 return
+            print('\n' + verification.render())
+            if verification:
+                print('\nSignature checking successful!\n')
+            else:
+                print('\nSignature checking FAILED!\n')
+        except RejectedError as e:
+            print('\nSignature REJECTED at {0} stage!\n'.format(e.stage))
+            print(e)
+        except VerificationError as e:
+            print('\nError checking signature!\n')
+            print(e)
+
+    @_pubkey_warning
+    def do_verifyall(self, arg):
+        """
+        Check signatures of many files ([filepath].sign or selected bundle): verifyall [filepath] [filepath] ...
+        """
+        paths = [i.replace("'", '') for i in arg.split(' ') if i]
+        if not paths:
+            print('Wrong params!')
+            return
+
+        bundle = self._open_bundle()
+        if bundle is False:
+            return
+        try:
+            for path, result in verify_files(paths, own_pubkey=self.key['pub'], bundle=bundle, cache=self.cache):
+                if isinstance(result, RejectedError):
+                    print('{0}: REJECTED ({1})'.format(path, result))
+                elif isinstance(result, VerificationError):
+                    print('{0}: error checking signature ({1})'.format(path, result))
+                elif result:
+                    print('{0}: OK'.format(path))
+                else:
+                    print('{0}: FAILED'.format(path))
+        finally:
+            if bundle is not None:
+                bundle.close()
+
+    @_pubkey_warning
+    def do_verifyarchive(self, arg):
+        """
+        Check signed members of tar archive (also .tar.gz, .tar.bz2, .tar.xz) without extracting it,
+        [name].sign members are signatures of [name] members: verifyarchive [archivepath]
+        """
+        path = arg.strip().replace("'", '')
+        if not path:
+            print('Wrong params!')
+            return
+        try:
+            for name, result in verify_archive(path, own_pubkey=self.key['pub'], cache=self.cache):
+                if isinstance(result, RejectedError):
+                    print('{0}: REJECTED ({1})'.format(name, result))
+                elif isinstance(result, VerificationError):
+                    print('{0}: error checking signature ({1})'.format(name, result))
+                elif result:
+                    print('{0}: OK'.format(name))
+                elif result.message:
+                    print('{0}: FAILED ({1})'.format(name, result.message))
+                else:
+                    print('{0}: FAILED'.format(name))
+        except (OSError, TarError) as e:
+            print('Cant read archive: {0}'.format(e))
+
+    def do_digest(self, arg):
+        """
+        Compute digest to sign or verify remotely: digest [filepath] (prints [digest] [filesize] [filepath])
+        """
+        path = arg.strip().replace("'", '')
+        try:
+            dgst, filesize = hash_file(path)
+        except OSError as e:
+            print(e)
+        else:
+            print('{0} {1} {2}'.format(hexlify(dgst).decode('ascii'), filesize, path))
+
+    @staticmethod
+    def _digest_args(arg, count):
+        args = [i.replace("'", '') for i in arg.split(' ') if i]
+        if len(args) not in count:
+            print('Wrong params!')
+            return None
+        try:
+            args[0] = unhexlify(args[0])
+            args[1] = int(args[1])
+        except (HexError, ValueError):
+            print('Wrong digest or file size!')
+            return None
+        return args
+
+    @_privkey_warning
+    def do_signdigest(self, arg):
+        """
+        Create signature from digest computed by digest command: signdigest [digest] [filesize] [filename] [signpath]
+        (signature is written to [filename].sign or [signpath], or added to selected bundle)
+        """
+        args = self._digest_args(arg, (3, 4))
+        if args is None:
+            return
+        dgst, filesize, filename = args[:3]
+        sign_path = args[3] if len(args) == 4 else filename + '.sign'
+        bundle = self._open_bundle() if len(args) == 3 else None
+        if bundle is False:
+            return
+        try:
+            result = sign_digest(
+                dgst, bundle.name_for(filename) if bundle else filename, filesize, self.key['curve'],
+                self.key['priv'], sign_path=sign_path, bundle=bundle
+            )
+        except SigningError as e:
+            print('\nError creating signature\n')
+            print(e)
+        else:
+            print(result.render())
+            print('\nSignature created!\n')
+        finally:
+            if bundle:
+                bundle.close()
+
+    @_pubkey_warning
+    def do_verifydigest(self, arg):
+        """
+        Check signature against digest computed by digest command: verifydigest [digest] [filesize] [signpath]
+        (verifydigest [digest] [filesize] [filename] with selected bundle)
+        """
+        args = self._digest_args(arg, (3,))
+        if args is None:
+            return
+        dgst, filesize, path = args
+        bundle = self._open_bundle()
+        if bundle is False:
+            return
+        try:
+            if bundle is not None:
+                verification = verify_digest(
+                    dgst, filesize, own_pubkey=self.key['pub'], bundle=bundle, name=bundle.name_for(path),
+                    cache=self.cache
+                )
+            else:
+                verification = verify_digest(dgst, filesize, sign_path=path, own_pubkey=self.key['pub'], cache=self.cache)
+            print('\n' + verification.render())
             if verification:
                 print('\nSignature checking successful!\n')
             else:
                 print('\nSignature checking FAILED!\n')
+        except RejectedError as e:
+            print('\nSignature REJECTED at {0} stage!\n'.format(e.stage))
+            print(e)
         except VerificationError as e:
             print('\nError checking signature!\n')
             print(e)
+        finally:
+            if bundle is not None:
+                bundle.close()
 
 
 if __name__ == '__main__':
+    shell = Shell()
     try:
-        Shell().cmdloop()
+        shell.cmdloop()
     except KeyboardInterrupt:
         print('Shutting down...')
+        shell.jobs.shutdown()
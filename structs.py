@@ -1,3 +1,5 @@
+from pyasn1.codec.der import encoder, decoder
+from pyasn1.error import PyAsn1Error
 from pyasn1.type import univ, namedtype, tag
 from pyasn1.type.char import UTF8String
 
@@ -46,6 +48,17 @@ class PrettySequence(PyasnPrettifierMixin, univ.Sequence):
     pass
 
 
+class PrettySequenceOf(univ.SequenceOf):
+    own_formatter = True
+
+    def prettyPrint(self, scope=0):
+        scope += 1
+        representation = self.__class__.__name__ + ':\n'
+        for componentValue in self:
+            representation += ' ' * scope + componentValue.prettyPrint(scope)
+        return representation
+
+
 class OpenKey(PrettySequence):
     componentType = namedtype.NamedTypes(
         namedtype.NamedType('x', univ.Integer()),
@@ -105,6 +118,40 @@ class FileMetaSequence(PrettySequence):
     )
 
 
+class CurveSequence(PrettySequence):
+    """Curve block of co-signature container, same fields as in KeyDataSequence"""
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('cryptosystem_p', CryptosystemParams()),
+        namedtype.NamedType('curve_p', CurveParams()),
+        namedtype.NamedType('dots_p', DotsParams()),
+        namedtype.NamedType('q', univ.Integer())
+    )
+
+
+class CurveSequenceOf(PrettySequenceOf):
+    componentType = CurveSequence()
+
+
+class CoSignerSequence(PrettySequence):
+    """Additional signer: curve index (0 - curve of params block, n - curves[n - 1]), open key and (r, s)"""
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('curve', univ.Integer()),
+        namedtype.NamedType('open_key', OpenKey()),
+        namedtype.NamedType('sign', SignatureParamsSequence())
+    )
+
+
+class CoSignerSequenceOf(PrettySequenceOf):
+    componentType = CoSignerSequence()
+
+
+class CoSignatures(PrettySequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('curves', CurveSequenceOf()),
+        namedtype.NamedType('signers', CoSignerSequenceOf())
+    )
+
+
 class SignatureSequence(PrettySequence):
     componentType = namedtype.NamedTypes(
         namedtype.NamedType('params', KeyDataSet()),
@@ -112,3 +159,57 @@ class SignatureSequence(PrettySequence):
         namedtype.NamedType('meta', FileMetaSequence())
 
     )
+
+
+class CoSignedSequence(PrettySequence):
+    """
+    Decoded co-signature container: SignatureSequence of the primary signer plus signatures of the same digest
+    by other keys in cosign. Never encoded as one sequence, see encode_signature()
+    """
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('params', KeyDataSet()),
+        namedtype.NamedType('sign', SignatureParamsSequence()),
+        namedtype.NamedType('meta', FileMetaSequence()),
+        namedtype.NamedType('cosign', CoSignatures())
+    )
+
+
+def _der_length(length):
+    if length < 0x80:
+        return bytes((length,))
+    octets = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(octets),)) + octets
+
+
+def encode_signature(s, params_der=None):
+    """
+    DER of SignatureSequence, or of co-signature container as SignatureSequence DER followed by CoSignatures DER.
+    Decoders unaware of co-signing stop after the first sequence and check the primary signature
+    :param params_der: DER of params (KeyDataSet) block encoded beforehand, spliced in instead of encoding it again
+    """
+    if params_der is None:
+        params_der = encoder.encode(s.getComponentByName('params'))
+    body = params_der + encoder.encode(s.getComponentByName('sign')) + encoder.encode(s.getComponentByName('meta'))
+    # Universal constructed SEQUENCE, SignatureSequence has no own tag
+    der = b'\x30' + _der_length(len(body)) + body
+    if isinstance(s, CoSignedSequence):
+        der += encoder.encode(s.getComponentByName('cosign'))
+    return der
+
+
+def decode_signature(der):
+    """
+    Decode output of encode_signature(), returns SignatureSequence or CoSignedSequence
+    :raises PyAsn1Error: if DER is malformed or has trailing data
+    """
+    plain, rest = decoder.decode(der, asn1Spec=SignatureSequence())
+    if not rest:
+        return plain
+    cosign, rest = decoder.decode(rest, asn1Spec=CoSignatures())
+    if rest:
+        raise PyAsn1Error('{0} bytes of trailing data after signature'.format(len(rest)))
+    s = CoSignedSequence()
+    for name in ('params', 'sign', 'meta'):
+        s.setComponentByName(name, plain.getComponentByName(name))
+    s.setComponentByName('cosign', cosign)
+    return s
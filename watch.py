@@ -0,0 +1,387 @@
+"""
+Watch mode: keep signatures of a changing tree up to date.
+
+Changes are reported by Linux inotify (through ctypes) or, where it is not available, by polling
+file stats. Events are debounced: a file is signed only after it has been quiet for `debounce` seconds.
+Changed files are hashed by a bounded thread pool and re-signed only if size or digest differs from
+the manifest, signatures go to [path].sign files or to a bundle.
+
+Manifest (JSON, path -> size, mtime, digest) is saved after every batch of results. On start the tree
+is reconciled against it: files with the same size and mtime are trusted without rehashing, other
+files are queued, signatures of files deleted meanwhile are removed.
+"""
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+from binascii import hexlify
+from concurrent.futures import ThreadPoolExecutor
+
+
+from core import hash_file
+
+MANIFEST_NAME = '.gostwatch.json'
+DEFAULT_DEBOUNCE = 1.0
+POLL_INTERVAL = 2.0
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT = struct.Struct('iIII')
+
+# poll() returns this instead of paths when events were lost and the whole tree must be rescanned
+RESCAN = None
+
+
+def walk(root, ignored=()):
+    """
+    Relative paths of files under root, except .sign files and ignored paths
+    """
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(dirpath, filename), root)
+            if not filename.endswith('.sign') and path not in ignored:
+                yield path
+
+
+class InotifyWatcher(object):
+    """
+    Recursive inotify watch of directory tree
+    """
+
+    def __init__(self, root):
+        self.root = root
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        self._watch_tree(root)
+
+    def _watch_tree(self, top):
+        created = []
+        for dirpath, _, filenames in os.walk(top):
+            wd = self._add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd >= 0:
+                self._dirs[wd] = os.path.relpath(dirpath, self.root)
+            # Files created before the watch was added
+            created.extend(os.path.normpath(os.path.relpath(os.path.join(dirpath, f), self.root)) for f in filenames)
+        return created
+
+    def poll(self, timeout):
+        """
+        Paths changed during timeout seconds, RESCAN if events were lost
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + name_len].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                return [RESCAN]
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.normpath(os.path.join(directory, name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.extend(self._watch_tree(os.path.join(self.root, path)))
+                elif mask & IN_MOVED_FROM:
+                    return [RESCAN]
+            else:
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher(object):
+    """
+    Fallback watcher comparing file stats every interval seconds
+    """
+
+    def __init__(self, root, interval=POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for path in walk(self.root):
+            try:
+                st = os.stat(os.path.join(self.root, path))
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = [path for path, stat in snapshot.items() if self._snapshot.get(path) != stat]
+        changed.extend(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def watcher_for(root):
+    """
+    Inotify watcher if available, polling watcher otherwise
+    """
+    try:
+        return InotifyWatcher(root)
+    except (OSError, AttributeError):
+        return PollingWatcher(root)
+
+
+class Debouncer(object):
+    """
+    Holds paths until no events came for them during delay seconds
+    """
+
+    def __init__(self, delay=DEFAULT_DEBOUNCE):
+        self.delay = delay
+        self._touched = {}
+
+    def touch(self, path, now=None):
+        self._touched[path] = now if now is not None else time.monotonic()
+
+    def ready(self, now=None, limit=None):
+        """
+        Remove and return quiet paths, at most limit of them
+        """
+        now = now if now is not None else time.monotonic()
+        ready = [path for path, touched in self._touched.items() if now - touched >= self.delay]
+        ready.sort(key=self._touched.get)
+        ready = ready[:limit]
+        for path in ready:
+            del self._touched[path]
+        return ready
+
+    def __len__(self):
+        return len(self._touched)
+
+
+def _sign(root, path, known, signer):
+    """
+    Hash file and sign it if it differs from manifest entry known, runs in pool thread.
+    Returns (path, manifest entry or None if file is gone, DER or None if unchanged)
+    """
+    full_path = os.path.join(root, path)
+    try:
+        before = os.stat(full_path)
+        dgst, size = hash_file(full_path)
+        after = os.stat(full_path)
+    except FileNotFoundError:
+        return path, None, None
+    if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+        raise _Changed(path)
+    entry = [size, after.st_mtime_ns, hexlify(dgst).decode('ascii')]
+    if known is not None and known[0] == entry[0] and known[2] == entry[2]:
+        return path, entry, None
+    der = signer.encode(signer.create_signature(dgst, filename=os.path.basename(path), filesize=size))
+    return path, entry, der
+
+
+class _Changed(Exception):
+    """File was written while it was hashed."""
+
+
+class Watch(object):
+    """
+    Incremental re-signing of directory tree
+    """
+
+    def __init__(self, root, signer, bundle=None, manifest_path=None, workers=2, debounce=DEFAULT_DEBOUNCE,
+                 watcher=None):
+        """
+        :param signer: core.Signer used by all workers
+        :param bundle: SignatureBundle to keep up to date instead of [path].sign files
+        :param manifest_path: manifest file, [root]/.gostwatch.json by default
+        :param workers: max files hashed at once
+        """
+        self.root = root
+        self.signer = signer
+        self.bundle = bundle
+        self.manifest_path = manifest_path or os.path.join(root, MANIFEST_NAME)
+        self.workers = workers
+        self.debouncer = Debouncer(debounce)
+        self.watcher = watcher or watcher_for(root)
+        self.manifest = self._load_manifest()
+        self._ignored = set()
+        bundle_paths = (bundle.path, bundle.path + '.tmp') if bundle is not None else ()
+        for path in (self.manifest_path, self.manifest_path + '.tmp') + bundle_paths:
+            if path:
+                self._ignored.add(os.path.relpath(os.path.abspath(path), os.path.abspath(root)))
+        self._pool = ThreadPoolExecutor(workers)
+        self._running = {}
+        self._dirty = False
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': 1, 'files': self.manifest}, f, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        self._dirty = False
+
+    def reconcile(self):
+        """
+        Queue files changed since manifest was saved, without rehashing unchanged ones.
+        Returns number of queued files
+        """
+        present = set()
+        queued = 0
+        for path in walk(self.root, self._ignored):
+            present.add(path)
+            known = self.manifest.get(path)
+            try:
+                st = os.stat(os.path.join(self.root, path))
+            except OSError:
+                continue
+            if known is not None and not self._has_signature(path):
+                # Signature was removed, sign again even if content is the same
+                del self.manifest[path]
+                known = None
+            if known is None or (known[0], known[1]) != (st.st_size, st.st_mtime_ns):
+                self.debouncer.touch(path, 0)
+                queued += 1
+        for path in [p for p in self.manifest if p not in present]:
+            self._remove(path)
+        return queued
+
+    def _has_signature(self, path):
+        if self.bundle is not None:
+            return self.bundle.name_for(os.path.join(self.root, path)) in self.bundle
+        return os.path.exists(os.path.join(self.root, path) + '.sign')
+
+    def _remove(self, path):
+        self.manifest.pop(path, None)
+        self._dirty = True
+        if self.bundle is None:
+            try:
+                os.remove(os.path.join(self.root, path) + '.sign')
+            except FileNotFoundError:
+                pass
+
+    def _write(self, path, der):
+        full_path = os.path.join(self.root, path)
+        if self.bundle is not None:
+            self.bundle.add(self.bundle.name_for(full_path), der)
+        else:
+            tmp_path = full_path + '.sign.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(der)
+            os.replace(tmp_path, full_path + '.sign')
+
+    def step(self, timeout=0.5):
+        """
+        Collect events for up to timeout seconds, start hashing of quiet files and apply finished results.
+        Returns list of (path, action), action is 'signed', 'unchanged', 'removed' or exception
+        """
+        for path in self.watcher.poll(timeout):
+            if path is RESCAN:
+                self.reconcile()
+            elif path not in self._ignored and not path.endswith('.sign') and not path.endswith('.sign.tmp'):
+                self.debouncer.touch(path)
+
+        # Bounded pool: never more than workers files in flight, the same file is never hashed twice at once
+        free = self.workers - len(self._running)
+        for path in self.debouncer.ready(limit=max(free, 0)):
+            if path in self._running:
+                self.debouncer.touch(path)
+                continue
+            self._running[path] = self._pool.submit(_sign, self.root, path, self.manifest.get(path), self.signer)
+        return self._collect()
+
+    def _collect(self):
+        actions = []
+        for path, future in list(self._running.items()):
+            if not future.done():
+                continue
+            del self._running[path]
+            try:
+                _, entry, der = future.result()
+            except _Changed:
+                self.debouncer.touch(path)
+                continue
+            except Exception as e:
+                actions.append((path, e))
+                continue
+            if entry is None:
+                if path in self.manifest:
+                    self._remove(path)
+                    actions.append((path, 'removed'))
+                continue
+            if der is not None:
+                self._write(path, der)
+                actions.append((path, 'signed'))
+            else:
+                actions.append((path, 'unchanged'))
+            self.manifest[path] = entry
+            self._dirty = True
+
+        if self._dirty:
+            if self.bundle is not None:
+                self.bundle.flush()
+            self.save_manifest()
+        return actions
+
+    @property
+    def idle(self):
+        return not self._running and not len(self.debouncer)
+
+    def run(self, stop=None, on_action=None):
+        """
+        Reconcile and process changes until stop event is set (or KeyboardInterrupt)
+        """
+        self.reconcile()
+        while stop is None or not stop.is_set():
+            for path, action in self.step():
+                if on_action is not None:
+                    on_action(path, action)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        # Results of files hashed while stopping
+        self._collect()
+        self.watcher.close()
+        if self._dirty:
+            self.save_manifest()